@@ -0,0 +1,20 @@
+from accounts.services import UserService
+
+
+class ActiveUserMiddleware:
+    """
+    record when an authenticated user was last seen, newsfeeds are only
+    pushed to the cache of active users
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        # rest framework authenticates in the view and sets the user back
+        # on the django request, so check it after the response
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            UserService.mark_active(user.id)
+        return response
@@ -2,8 +2,16 @@ from accounts.models import UserProfile
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.cache import caches
-from twitter.cache import USER_PROFILE_PATTERN
+from twitter.cache import (
+    USER_PROFILE_PATTERN,
+    ACTIVE_USERS_KEY,
+    ACTIVE_USER_MARKED_PATTERN,
+)
+from utils.local_cache import local_cache
 from utils.memcached_helper import MemcachedHelper
+from utils.redis_client import RedisClient
+
+import time
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
@@ -17,19 +25,84 @@ class UserService:
     @classmethod
     def get_profile_through_cache(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
+        return MemcachedHelper.get_through_cache(
+            key,
+            lambda: UserProfile.objects.get_or_create(user_id=user_id)[0],
+        )
+
+    @classmethod
+    def load_profiles(cls, user_ids):
+        profiles = {
+            profile.user_id: profile
+            for profile in UserProfile.objects.filter(user_id__in=user_ids)
+        }
+        # users who never had a profile get one created like get_profile_through_cache
+        for user_id in user_ids:
+            if user_id not in profiles:
+                profiles[user_id], _ = UserProfile.objects.get_or_create(user_id=user_id)
+        return profiles
 
-        # read from cache first
-        profile = cache.get(key)
-        # cache hit return
-        if profile is not None:
-            return profile
+    @classmethod
+    def get_profiles_through_cache(cls, user_ids):
+        """
+        batch version of get_profile_through_cache, returns a dict of
+        user_id -> profile
+        """
+        keys = {USER_PROFILE_PATTERN.format(user_id=user_id): user_id for user_id in user_ids}
+        return MemcachedHelper.get_many_through_cache(keys, cls.load_profiles)
 
-        # cache miss, read from db
-        profile, _ = UserProfile.objects.get_or_create(user_id=user_id)
-        cache.set(key, profile)
-        return profile
+    @classmethod
+    def get_users_through_cache(cls, user_ids):
+        """
+        users of a page with their profiles attached, so that serializing
+        them needs no more cache round trips
+        """
+        users = MemcachedHelper.get_objects_through_cache(User, user_ids)
+        profiles = cls.get_profiles_through_cache(users.keys())
+        for user_id, user in users.items():
+            setattr(user, '_cached_user_profile', profiles[user_id])
+        return users
 
     @classmethod
     def invalidate_profile(cls, user_id):
         key = USER_PROFILE_PATTERN.format(user_id=user_id)
         cache.delete(key)
+        local_cache.invalidate(key)
+        # locally cached users carry their profile along
+        local_cache.invalidate(MemcachedHelper.get_key(User, user_id))
+
+    @classmethod
+    def mark_active(cls, user_id):
+        # a sorted set of user_id -> last seen. the window is much longer
+        # than the interval, so each process only marks a user once per
+        # interval
+        key = ACTIVE_USER_MARKED_PATTERN.format(user_id=user_id)
+        if local_cache.get(key) is not None:
+            return
+        conn = RedisClient.get_connection()
+        conn.zadd(ACTIVE_USERS_KEY, {user_id: time.time()})
+        local_cache.set(key, True, settings.ACTIVE_USER_MARK_INTERVAL)
+
+    @classmethod
+    def trim_active_users(cls):
+        # users who stayed away longer than the window are dropped
+        conn = RedisClient.get_connection()
+        since = time.time() - settings.ACTIVE_USER_WINDOW
+        return conn.zremrangebyscore(ACTIVE_USERS_KEY, '-inf', since)
+
+    @classmethod
+    def get_active_user_ids(cls, user_ids):
+        user_ids = list(user_ids)
+        if not user_ids:
+            return set()
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline(transaction=False)
+        for user_id in user_ids:
+            pipeline.zscore(ACTIVE_USERS_KEY, user_id)
+        last_seen = pipeline.execute()
+        since = time.time() - settings.ACTIVE_USER_WINDOW
+        return set(
+            user_id
+            for user_id, timestamp in zip(user_ids, last_seen)
+            if timestamp is not None and timestamp >= since
+        )
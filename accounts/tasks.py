@@ -0,0 +1,9 @@
+from accounts.services import UserService
+from celery import shared_task
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def trim_active_users_task():
+    trimmed = UserService.trim_active_users()
+    return '{} inactive users trimmed'.format(trimmed)
@@ -1,5 +1,15 @@
+from django.conf import settings
+from django.contrib.auth.models import User
 from accounts.models import UserProfile
+from accounts.services import UserService
+from accounts.tasks import trim_active_users_task
 from testing_utils.testcases import TestCase
+from twitter.cache import ACTIVE_USERS_KEY
+from utils.local_cache import local_cache
+from utils.memcached_helper import MemcachedHelper
+from utils.redis_client import RedisClient
+
+import time
 
 
 class UserProfileTests(TestCase):
@@ -13,3 +23,54 @@ class UserProfileTests(TestCase):
         p = ray.profile
         self.assertEqual(isinstance(p, UserProfile), True)
         self.assertEqual(UserProfile.objects.count(), 1)
+
+    def test_get_users_through_cache(self):
+        ray = self.create_user('ray')
+        lux = self.create_user('lux')
+        ray.profile.nickname = 'raymond'
+        ray.profile.save()
+
+        users = UserService.get_users_through_cache([ray.id, lux.id, 0])
+        self.assertEqual(set(users.keys()), {ray.id, lux.id})
+        self.assertEqual(users[ray.id].username, 'ray')
+        self.assertEqual(users[ray.id].profile.nickname, 'raymond')
+        # profiles missing in db are created
+        self.assertEqual(UserProfile.objects.filter(user=lux).exists(), True)
+
+        # the second time everything comes from cache
+        with self.assertNumQueries(0):
+            users = UserService.get_users_through_cache([ray.id, lux.id])
+            self.assertEqual(users[lux.id].profile.user_id, lux.id)
+        # profiles are attached to copies of the shared cached users
+        cached_lux = MemcachedHelper.get_object_through_cache(User, lux.id)
+        self.assertEqual(hasattr(cached_lux, '_cached_user_profile'), False)
+
+        # invalidated cache is reloaded
+        ray.profile.nickname = 'ray'
+        ray.profile.save()
+        profiles = UserService.get_profiles_through_cache([ray.id])
+        self.assertEqual(profiles[ray.id].nickname, 'ray')
+
+    def test_active_users(self):
+        ray, ray_client = self.create_user_and_client('ray')
+        lux = self.create_user('lux')
+        self.assertEqual(UserService.get_active_user_ids([ray.id, lux.id]), set())
+
+        # authenticated requests mark users as active
+        ray_client.get('/api/tweets/', {'user_id': lux.id})
+        self.anonymous_client.get('/api/tweets/', {'user_id': lux.id})
+        self.assertEqual(UserService.get_active_user_ids([ray.id, lux.id]), {ray.id})
+
+        # a process marks the same user at most once per interval
+        conn = RedisClient.get_connection()
+        conn.zrem(ACTIVE_USERS_KEY, ray.id)
+        ray_client.get('/api/tweets/', {'user_id': lux.id})
+        self.assertEqual(UserService.get_active_user_ids([ray.id]), set())
+        local_cache.clear()
+        ray_client.get('/api/tweets/', {'user_id': lux.id})
+        self.assertEqual(UserService.get_active_user_ids([ray.id]), {ray.id})
+
+        # users who stayed away longer than the window are trimmed
+        conn.zadd(ACTIVE_USERS_KEY, {lux.id: time.time() - settings.ACTIVE_USER_WINDOW - 1})
+        self.assertEqual(trim_active_users_task(), '1 inactive users trimmed')
+        self.assertEqual(conn.zcard(ACTIVE_USERS_KEY), 1)
@@ -1,4 +1,5 @@
 from accounts.api.serializers import UserSerializerForComment
+from accounts.services import UserService
 from comments.models import Comment
 from likes.services import LikeService
 from rest_framework import serializers
@@ -7,7 +8,7 @@ from tweets.models import Tweet
 
 
 class CommentSerializer(serializers.ModelSerializer):
-    user = UserSerializerForComment(source='cached_user')
+    user = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     has_liked = serializers.SerializerMethodField()
 
@@ -24,6 +25,21 @@ class CommentSerializer(serializers.ModelSerializer):
             'has_liked',
         )
 
+    @classmethod
+    def get_page_context(cls, request, comments):
+        return {
+            'request': request,
+            'users': UserService.get_users_through_cache(
+                set(comment.user_id for comment in comments),
+            ),
+        }
+
+    def get_user(self, obj):
+        user = self.context.get('users', {}).get(obj.user_id)
+        if user is None:
+            user = obj.cached_user
+        return UserSerializerForComment(user).data
+
     def get_likes_count(self, obj):
         return obj.like_set.count()
 
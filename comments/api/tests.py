@@ -2,6 +2,7 @@ from comments.models import Comment
 from django.utils import timezone
 from rest_framework.test import APIClient
 from testing_utils.testcases import TestCase
+from tweets.tasks import flush_tweet_counts_task
 
 COMMENT_URL = '/api/comments/'
 COMMENT_DETAIL_URL = '/api/comments/{}/'
@@ -132,6 +133,14 @@ class CommentApiTests(TestCase):
         self.assertEqual(len(response.data['comments']), 2)
         self.assertEqual(response.data['comments'][0]['content'], '1')
         self.assertEqual(response.data['comments'][1]['content'], '2')
+        self.assertEqual(response.data['comments'][0]['user']['username'], self.ray.username)
+        self.assertEqual(response.data['comments'][1]['user']['username'], self.lux.username)
+
+        # authors of comments and likes are shown on the tweet detail as well
+        self.create_like(self.ray, self.tweet)
+        response = self.anonymous_client.get(TWEET_DETAIL_API.format(self.tweet.id))
+        self.assertEqual(response.data['comments'][1]['user']['id'], self.lux.id)
+        self.assertEqual(response.data['likes'][0]['user']['id'], self.ray.id)
 
         # both user_id and tweet_id are given, only tweet_id will be effective
         response = self.anonymous_client.get(COMMENT_URL, {
@@ -173,12 +182,14 @@ class CommentApiTests(TestCase):
             client.post(COMMENT_URL, data)
             response = client.get(tweet_url)
             self.assertEqual(response.data['comments_count'], i + 1)
+            flush_tweet_counts_task()
             self.tweet.refresh_from_db()
             self.assertEqual(self.tweet.comments_count, i + 1)
 
         comment_data = self.lux_client.post(COMMENT_URL, data).data
         response = self.lux_client.get(tweet_url)
         self.assertEqual(response.data['comments_count'], 3)
+        flush_tweet_counts_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 3)
 
@@ -188,6 +199,7 @@ class CommentApiTests(TestCase):
         self.assertEqual(response.status_code, 200)
         response = self.lux_client.get(tweet_url)
         self.assertEqual(response.data['comments_count'], 3)
+        flush_tweet_counts_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 3)
 
@@ -196,5 +208,6 @@ class CommentApiTests(TestCase):
         self.assertEqual(response.status_code, 200)
         response = self.ray_client.get(tweet_url)
         self.assertEqual(response.data['comments_count'], 2)
+        flush_tweet_counts_task()
         self.tweet.refresh_from_db()
         self.assertEqual(self.tweet.comments_count, 2)
@@ -30,12 +30,10 @@ class CommentViewSet(viewsets.GenericViewSet):
     @method_decorator(ratelimit(key='user', rate='10/s', method='GET', block=True))
     def list(self, request, *args, **kwargs):
         queryset = self.get_queryset()
-        comments = self.filter_queryset(queryset)\
-            .prefetch_related('user')\
-            .order_by('created_at')
+        comments = self.filter_queryset(queryset).order_by('created_at')
         serializer = CommentSerializer(
             comments,
-            context={'request': request},
+            context=CommentSerializer.get_page_context(request, comments),
             many=True,
         )
         return Response(
@@ -4,22 +4,16 @@ from utils.redis_helper import RedisHelper
 
 def incr_comments_count(sender, instance, created, **kwargs):
     from tweets.models import Tweet
-    from django.db.models import F
 
     if not created:
         return
 
-    # handle new comment
-    Tweet.objects.filter(id=instance.tweet_id)\
-        .update(comments_count=F('comments_count') + 1)
-    RedisHelper.incr_count(instance.tweet, 'comments_count')
+    # handle new comment, written to db in batches by flush_tweet_counts_task
+    RedisHelper.incr_buffered_count(Tweet(id=instance.tweet_id), 'comments_count')
 
 
 def decr_comments_count(sender, instance, **kwargs):
     from tweets.models import Tweet
-    from django.db.models import F
 
     # handle comment deletion
-    Tweet.objects.filter(id=instance.tweet_id)\
-        .update(comments_count=F('comments_count') - 1)
-    RedisHelper.decr_count(instance.tweet, 'comments_count')
+    RedisHelper.decr_buffered_count(Tweet(id=instance.tweet_id), 'comments_count')
@@ -0,0 +1,125 @@
+"""
+micro-benchmark of decoding scanned rows into HBaseModel instances
+
+compares the old decode path, which walked cls.__dict__ for every column of
+every row and stored values in instance __dict__, with the compiled
+HBaseModelCodec + __slots__ path. no HBase server is needed, rows are built
+in memory in the same shape as happybase scan results.
+
+usage: python -m django_hbase.benchmarks [rows]
+"""
+from django_hbase.models import HBaseField, IntegerField, TimestampField
+from friendships.hbase_models import HBaseFollowing
+
+import sys
+import timeit
+import tracemalloc
+
+
+class LegacyHBaseFollowing:
+    """
+    copy of the decode path of HBaseModel before codecs were compiled
+    """
+    from_user_id = IntegerField(reverse=True)
+    created_at = TimestampField()
+    to_user_id = IntegerField(column_family='cf')
+
+    class Meta:
+        row_key = ('from_user_id', 'created_at')
+
+    @classmethod
+    def get_field_hash(cls):
+        field_hash = {}
+        for field in cls.__dict__:
+            field_obj = getattr(cls, field)
+            if isinstance(field_obj, HBaseField):
+                field_hash[field] = field_obj
+        return field_hash
+
+    def __init__(self, **kwargs):
+        for key, field in self.get_field_hash().items():
+            value = kwargs.get(key)
+            setattr(self, key, value)
+
+    @classmethod
+    def init_from_row(cls, row_key, row_data):
+        if not row_data:
+            return None
+        data = cls.deserialize_row_key(row_key)
+        for column_key, column_value in row_data.items():
+            column_key = column_key.decode('utf-8')
+            key = column_key[column_key.find(':') + 1:]
+            data[key] = cls.deserialize_field(key, column_value)
+        return cls(**data)
+
+    @classmethod
+    def deserialize_row_key(cls, row_key):
+        data = {}
+        if isinstance(row_key, bytes):
+            row_key = row_key.decode('utf-8')
+        row_key = row_key + ':'
+        for key in cls.Meta.row_key:
+            index = row_key.find(':')
+            if index == -1:
+                break
+            data[key] = cls.deserialize_field(key, row_key[:index])
+            row_key = row_key[index + 1:]
+        return data
+
+    @classmethod
+    def deserialize_field(cls, key, value):
+        field = cls.get_field_hash()[key]
+        if field.reverse:
+            value = value[::-1]
+        if field.field_type in [IntegerField.field_type, TimestampField.field_type]:
+            return int(value)
+        return value
+
+
+def build_rows(count):
+    rows = []
+    for index in range(count):
+        instance = HBaseFollowing(
+            from_user_id=1,
+            created_at=1600000000000000 + index,
+            to_user_id=index + 2,
+        )
+        row_data = HBaseFollowing.serialize_row_data(instance.get_field_values())
+        rows.append((
+            instance.row_key,
+            {
+                key.encode('utf-8'): value.encode('utf-8')
+                for key, value in row_data.items()
+            },
+        ))
+    return rows
+
+
+def decode(model_class, rows):
+    return [model_class.init_from_row(row_key, row_data) for row_key, row_data in rows]
+
+
+def measure_memory(model_class, rows):
+    tracemalloc.start()
+    instances = decode(model_class, rows)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del instances
+    return size
+
+
+def main(count=1000, repeat=5):
+    rows = build_rows(count)
+    # both paths must decode to the same values
+    for legacy, compiled in zip(decode(LegacyHBaseFollowing, rows), decode(HBaseFollowing, rows)):
+        assert legacy.__dict__ == compiled.get_field_values()
+
+    print(f'decode {count} rows, best of {repeat}')
+    for name, model_class in [('legacy', LegacyHBaseFollowing), ('codec', HBaseFollowing)]:
+        seconds = min(timeit.repeat(lambda: decode(model_class, rows), number=1, repeat=repeat))
+        memory = measure_memory(model_class, rows)
+        print('{:>8}: {:8.2f} ms {:8.1f} KB'.format(name, seconds * 1000, memory / 1024))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -1,14 +1,99 @@
+from contextlib import contextmanager
 from django.conf import settings
+from thriftpy2.transport import TTransportException
 
 import happybase
+import socket
+import threading
+import time
+
+# errors raised when the thrift transport is broken, the pool replaces the
+# connection before re-raising them. errors returned by the server, e.g.
+# IOError or IllegalArgument, are not transient and are not retried
+BROKEN_CONNECTION_ERRORS = (TTransportException, socket.error)
 
 
 class HBaseClient:
-    conn = None
+    pool = None
+    lock = threading.Lock()
+    # how deep the current thread is nested in get_connection()
+    local = threading.local()
+    stats = {
+        'in_use': 0,
+        'checkouts': 0,
+        'timeouts': 0,
+        'reconnects': 0,
+        'retries': 0,
+    }
+
+    @classmethod
+    def get_pool(cls):
+        # one pool per process, created on first use
+        if cls.pool:
+            return cls.pool
+        with cls.lock:
+            if cls.pool is None:
+                cls.pool = happybase.ConnectionPool(
+                    size=settings.HBASE_POOL_SIZE,
+                    host=settings.HBASE_HOST,
+                )
+        return cls.pool
+
+    @classmethod
+    def incr_stats(cls, name, delta=1):
+        with cls.lock:
+            cls.stats[name] += delta
+
+    @classmethod
+    def get_stats(cls):
+        with cls.lock:
+            stats = dict(cls.stats)
+        stats['size'] = settings.HBASE_POOL_SIZE
+        stats['available'] = stats['size'] - stats['in_use']
+        return stats
+
+    @classmethod
+    @contextmanager
+    def get_connection(cls, timeout=None):
+        """
+        check out a connection from the pool for the current thread,
+        nested calls in the same thread share the same connection
+        """
+        if timeout is None:
+            timeout = settings.HBASE_POOL_TIMEOUT
+        depth = getattr(cls.local, 'depth', 0)
+        try:
+            with cls.get_pool().connection(timeout=timeout) as conn:
+                if depth == 0:
+                    cls.incr_stats('checkouts')
+                    cls.incr_stats('in_use')
+                cls.local.depth = depth + 1
+                try:
+                    yield conn
+                finally:
+                    cls.local.depth = depth
+                    if depth == 0:
+                        cls.incr_stats('in_use', -1)
+        except happybase.NoConnectionsAvailable:
+            cls.incr_stats('timeouts')
+            raise
+        except BROKEN_CONNECTION_ERRORS:
+            cls.incr_stats('reconnects')
+            raise
 
     @classmethod
-    def get_connection(cls):
-        if cls.conn:
-            return cls.conn
-        cls.conn = happybase.Connection(settings.HBASE_HOST)
-        return cls.conn
+    def execute_read(cls, func):
+        """
+        run func(conn) with a pooled connection. func must be idempotent,
+        it is retried with exponential backoff if the connection is broken
+        """
+        retries = settings.HBASE_READ_RETRIES
+        for attempt in range(retries + 1):
+            try:
+                with cls.get_connection() as conn:
+                    return func(conn)
+            except BROKEN_CONNECTION_ERRORS:
+                if attempt == retries:
+                    raise
+                cls.incr_stats('retries')
+                time.sleep(settings.HBASE_RETRY_BACKOFF * 2 ** attempt)
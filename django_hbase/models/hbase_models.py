@@ -1,6 +1,10 @@
+from contextlib import contextmanager, ExitStack
 from django.conf import settings
 from django_hbase.models import HBaseField, IntegerField, TimestampField
 from django_hbase.client import HBaseClient
+from happybase.util import bytes_increment
+
+import threading
 
 
 class BadRowKeyError(Exception):
@@ -11,46 +15,275 @@ class EmptyColumnError(Exception):
     pass
 
 
-class HBaseModel:
+class HBaseModelCodec:
+    """
+    (de)serialization plan of one HBaseModel class. It is compiled once when
+    the class is defined, so scanning a table doesn't have to introspect the
+    model class again for every column of every row.
+    """
+
+    def __init__(self, fields, row_key):
+        # all fields in declaration order
+        self.fields = fields
+        self.encoders = {
+            key: self.build_encoder(field)
+            for key, field in fields.items()
+        }
+        self.decoders = {
+            key: self.build_decoder(field)
+            for key, field in fields.items()
+        }
+        # fields without column family make up the row key
+        self.row_key_encoders = [
+            (key, self.encoders[key])
+            for key, field in fields.items()
+            if not field.column_family
+        ]
+        self.row_key_fields = list(row_key)
+        self.row_key_decoders = [(key, self.decoders[key]) for key in row_key]
+        # column key (str) used for writing, column key (bytes) for reading
+        self.column_encoders = [
+            (key, '{}:{}'.format(field.column_family, key), self.encoders[key])
+            for key, field in fields.items()
+            if field.column_family
+        ]
+        self.column_decoders = {
+            column_key.encode('utf-8'): (key, self.decoders[key])
+            for key, column_key, _ in self.column_encoders
+        }
+        self.column_families = {
+            field.column_family
+            for field in fields.values()
+            if field.column_family is not None
+        }
+
+    @classmethod
+    def build_encoder(cls, field):
+        if isinstance(field, IntegerField):
+            # set the length of int is 16; put 0 to empty place
+            if field.reverse:
+                return lambda value: str(value).rjust(16, '0')[::-1]
+            return lambda value: str(value).rjust(16, '0')
+        if field.reverse:
+            return lambda value: str(value)[::-1]
+        return str
+
+    @classmethod
+    def build_decoder(cls, field):
+        # values can be str (row key) or bytes (column value)
+        if field.field_type in [IntegerField.field_type, TimestampField.field_type]:
+            if field.reverse:
+                return lambda value: int(value[::-1])
+            return int
+        if field.reverse:
+            return lambda value: value[::-1]
+        return lambda value: value
+
+    def encode_row_key(self, data, is_prefix=False):
+        values = []
+        for key, encode in self.row_key_encoders:
+            value = data.get(key)
+            if value is None:
+                if not is_prefix:
+                    raise BadRowKeyError(f"{key} is missing in row key")
+                break
+            value = encode(value)
+            if ':' in value:
+                raise BadRowKeyError(f"{key} should not contain ':' in value: {value}")
+            values.append(value)
+        return bytes(':'.join(values), encoding='utf-8')
+
+    def decode_row_key(self, row_key):
+        if isinstance(row_key, bytes):
+            row_key = row_key.decode('utf-8')
+        # zip stops at the shorter one, so a prefix only fills leading keys
+        return {
+            key: decode(value)
+            for (key, decode), value in zip(self.row_key_decoders, row_key.split(':'))
+        }
+
+    def decode_row_key_field(self, row_key, field_name):
+        if isinstance(row_key, bytes):
+            row_key = row_key.decode('utf-8')
+        index = self.row_key_fields.index(field_name)
+        return self.decoders[field_name](row_key.split(':')[index])
+
+    def encode_row_data(self, data):
+        row_data = {}
+        for key, column_key, encode in self.column_encoders:
+            column_value = data.get(key)
+            if column_value is None:
+                continue
+            row_data[column_key] = encode(column_value)
+        return row_data
+
+    def decode_row(self, row_key, row_data):
+        data = self.decode_row_key(row_key)
+        for column_key, column_value in row_data.items():
+            key, decode = self.decode_column_key(column_key)
+            data[key] = decode(column_value)
+        return data
+
+    def get_column_keys(self, field_names):
+        # column projection, field names => column keys
+        if field_names is None:
+            return None
+        return [
+            '{}:{}'.format(self.fields[key].column_family, key)
+            for key in field_names
+        ]
+
+    def decode_column_key(self, column_key):
+        if column_key in self.column_decoders:
+            return self.column_decoders[column_key]
+        # remove column family
+        column_key = column_key.decode('utf-8')
+        key = column_key[column_key.find(':') + 1:]
+        return key, self.decoders[key]
+
+
+class HBaseModelMeta(type):
+    """
+    collects the HBaseFields of a model into an HBaseModelCodec and stores
+    field values in __slots__, instances carry no __dict__ at all
+    """
+
+    def __new__(mcs, name, bases, attrs):
+        fields = {}
+        # fields of parent models are inherited, they already own their slots
+        for base in reversed(bases):
+            if hasattr(base, '_codec'):
+                fields.update(base._codec.fields)
+        own_fields = {
+            key: value
+            for key, value in attrs.items()
+            if isinstance(value, HBaseField)
+        }
+        for key in own_fields:
+            del attrs[key]
+        fields.update(own_fields)
+        attrs['__slots__'] = tuple(own_fields)
+
+        cls = super().__new__(mcs, name, bases, attrs)
+        cls._codec = HBaseModelCodec(fields, cls.Meta.row_key)
+        return cls
+
+
+class HBaseBatch:
+    """
+    buffers puts and deletes of any HBaseModel and sends them when the scope
+    exits. save / delete / bulk_* called inside the scope join the batch,
+    nested scopes join the outermost one.
+
+    it is not a transaction: a table sends its mutations every batch_size of
+    them, and if the scope fails only the ones not sent yet are dropped.
+    puts and deletes by row key are idempotent, so a failed scope can simply
+    be run again.
+
+    with HBaseModel.batch():
+        HBaseFollower.create(...)
+        HBaseFollowing.create(...)
+    """
+    local = threading.local()
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or settings.HBASE_BATCH_SIZE
+        self.outer = None
+        self.conn = None
+        self.exit_stack = None
+        # table name => happybase batch
+        self.table_batches = {}
+
+    @classmethod
+    def get_current(cls):
+        return getattr(cls.local, 'current', None)
+
+    def __enter__(self):
+        self.outer = self.get_current()
+        if self.outer is not None:
+            return self.outer
+        self.exit_stack = ExitStack()
+        self.conn = self.exit_stack.enter_context(HBaseClient.get_connection())
+        HBaseBatch.local.current = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.outer is not None:
+            return False
+        HBaseBatch.local.current = None
+        with self.exit_stack:
+            # the mutations not sent yet are dropped if the scope failed
+            if exc_type is None:
+                for table_batch in self.table_batches.values():
+                    table_batch.send()
+        return False
+
+    def get_table_batch(self, model_class):
+        table_name = model_class.get_table_name()
+        if table_name not in self.table_batches:
+            table = self.conn.table(table_name)
+            self.table_batches[table_name] = table.batch(batch_size=self.batch_size)
+        return self.table_batches[table_name]
+
+
+class HBaseModel(metaclass=HBaseModelMeta):
 
     class Meta:
         table_name = None
         row_key = ()
 
     @classmethod
+    @contextmanager
     def get_table(cls):
-        conn = HBaseClient.get_connection()
-        return conn.table(cls.get_table_name())
+        with HBaseClient.get_connection() as conn:
+            yield conn.table(cls.get_table_name())
+
+    @classmethod
+    @contextmanager
+    def get_table_batch(cls, batch_size=None):
+        """
+        batch of mutations on the table of this model, it joins the current
+        HBaseBatch scope if there is one, otherwise it is sent on exit
+        """
+        batch = HBaseBatch.get_current()
+        if batch is not None:
+            yield batch.get_table_batch(cls)
+            return
+        with cls.get_table() as table:
+            with table.batch(batch_size=batch_size or settings.HBASE_BATCH_SIZE) as table_batch:
+                yield table_batch
+
+    @classmethod
+    def batch(cls, batch_size=None):
+        return HBaseBatch(batch_size)
+
+    @classmethod
+    def read_table(cls, func):
+        # reads are idempotent, they can be retried on a broken connection
+        return HBaseClient.execute_read(
+            lambda conn: func(conn.table(cls.get_table_name())),
+        )
 
     @property
     def row_key(self):
-        return self.serialize_row_key(self.__dict__)
+        return self.serialize_row_key(self.get_field_values())
 
     @classmethod
     def get_field_hash(cls):
-        field_hash = {}
-        for field in cls.__dict__:
-            field_obj = getattr(cls, field)
-            if isinstance(field_obj, HBaseField):
-                field_hash[field] = field_obj
-        return field_hash
+        return cls._codec.fields
 
     def __init__(self, **kwargs):
-        for key, field in self.get_field_hash().items():
-            value = kwargs.get(key)
-            setattr(self, key, value)
+        for key in self._codec.fields:
+            setattr(self, key, kwargs.get(key))
+
+    def get_field_values(self):
+        return {key: getattr(self, key) for key in self._codec.fields}
 
     @classmethod
     def init_from_row(cls, row_key, row_data):
         if not row_data:
             return None
-        data = cls.deserialize_row_key(row_key)
-        for column_key, column_value in row_data.items():
-            # remove column family
-            column_key = column_key.decode('utf-8')
-            key = column_key[column_key.find(':') + 1:]
-            data[key] = cls.deserialize_field(key, column_value)
-        return cls(**data)
+        return cls(**cls._codec.decode_row(row_key, row_data))
 
     @classmethod
     def serialize_row_key(cls, data, is_prefix=False):
@@ -60,21 +293,7 @@ class HBaseModel:
         {key1: val1, key2: val2} => b"val1:val2"
         {key1: val1, key2: val2, key3: val3} => b"val1:val2:val3"
         """
-        field_hash = cls.get_field_hash()
-        values = []
-        for key, field in field_hash.items():
-            if field.column_family:
-                continue
-            value = data.get(key)
-            if value is None:
-                if not is_prefix:
-                    raise BadRowKeyError(f"{key} is missing in row key")
-                break
-            value = cls.serialize_field(field, value)
-            if ':' in value:
-                raise BadRowKeyError(f"{key} should not contain ':' in value: {value}")
-            values.append(value)
-        return bytes(':'.join(values), encoding='utf-8')
+        return cls._codec.encode_row_key(data, is_prefix=is_prefix)
 
     @classmethod
     def deserialize_row_key(cls, row_key):
@@ -83,71 +302,57 @@ class HBaseModel:
         "val1:val2" => {'key1': val1, 'key2': val2, 'key3': None}
         "val1:val2:val3" => {'key1': val1, 'key2': val2, 'key3': val3}
         """
-        data = {}
-        if isinstance(row_key, bytes):
-            row_key = row_key.decode('utf-8')
-
-        # val1:val2 => val1:val2: easier to find values
-        row_key = row_key + ':'
-        for key in cls.Meta.row_key:
-            index = row_key.find(':')
-            if index == -1:
-                break
-            data[key] = cls.deserialize_field(key, row_key[:index])
-            row_key = row_key[index + 1:]
-        return data
+        return cls._codec.decode_row_key(row_key)
 
     @classmethod
     def serialize_field(cls, field, value):
-        value = str(value)
-        if isinstance(field, IntegerField):
-            # set the length of int is 16; put 0 to empty place
-            value = str(value)
-            while len(value) < 16:
-                value = '0' + value
-        if field.reverse:
-            value = value[::-1]
-        return value
+        return HBaseModelCodec.build_encoder(field)(value)
 
     @classmethod
     def deserialize_field(cls, key, value):
-        field = cls.get_field_hash()[key]
-        if field.reverse:
-            value = value[::-1]
-        if field.field_type in [IntegerField.field_type, TimestampField.field_type]:
-            return int(value)
-        return value
+        return cls._codec.decoders[key](value)
 
     @classmethod
     def serialize_row_data(cls, data):
-        row_data = {}
-        field_hash = cls.get_field_hash()
-        for key, field in field_hash.items():
-            if not field.column_family:
-                continue
-            column_key = '{}:{}'.format(field.column_family, key)
-            column_value = data.get(key)
-            if column_value is None:
-                continue
-            row_data[column_key] = cls.serialize_field(field, column_value)
-        return row_data
+        return cls._codec.encode_row_data(data)
 
-    def save(self):
-        row_data = self.serialize_row_data(self.__dict__)
+    def get_row_data(self):
+        row_data = self.serialize_row_data(self.get_field_values())
         # if row_data is empty，no column key values will be stored
         # raise an exception to avoid storing None
         if len(row_data) == 0:
             raise EmptyColumnError()
-        table = self.get_table()
-        table.put(self.row_key, row_data)
+        return row_data
+
+    def save(self):
+        row_data = self.get_row_data()
+        with self.get_table_batch() as table_batch:
+            table_batch.put(self.row_key, row_data)
 
     @classmethod
     def get(cls, **kwargs):
         row_key = cls.serialize_row_key(kwargs)
-        table = cls.get_table()
-        row_data = table.row(row_key)
+        row_data = cls.read_table(lambda table: table.row(row_key))
         return cls.init_from_row(row_key, row_data)
 
+    @classmethod
+    def get_many(cls, keys, columns=None):
+        """
+        fetch many rows in one request. keys is a list of row key dicts, as the
+        kwargs of get(). instances are returned in the order of keys, None for
+        missing rows. columns is an optional list of field names to fetch.
+        """
+        if not keys:
+            return []
+        row_keys = [cls.serialize_row_key(key) for key in keys]
+        column_keys = cls._codec.get_column_keys(columns)
+        rows = cls.read_table(lambda table: table.rows(row_keys, columns=column_keys))
+        row_data_by_key = dict(rows)
+        return [
+            cls.init_from_row(row_key, row_data_by_key.get(row_key))
+            for row_key in row_keys
+        ]
+
     @classmethod
     def create(cls, **kwargs):
         instance = cls(**kwargs)
@@ -166,24 +371,23 @@ class HBaseModel:
     def drop_table(cls):
         if not settings.TESTING:
             raise Exception('You can not drop table outside of unit tests')
-        conn = HBaseClient.get_connection()
-        conn.delete_table(cls.get_table_name(), True)
+        with HBaseClient.get_connection() as conn:
+            conn.delete_table(cls.get_table_name(), True)
 
     @classmethod
     def create_table(cls):
         if not settings.TESTING:
             raise Exception('You can not create table outside of unit tests')
-        conn = HBaseClient.get_connection()
-        # convert table name from byte to string
-        tables = [table.decode('utf-8') for table in conn.tables()]
-        if cls.get_table_name() in tables:
-            return
-        column_families = {
-            field.column_family: dict()
-            for key, field in cls.get_field_hash().items()
-            if field.column_family is not None
-        }
-        conn.create_table(cls.get_table_name(), column_families)
+        with HBaseClient.get_connection() as conn:
+            # convert table name from byte to string
+            tables = [table.decode('utf-8') for table in conn.tables()]
+            if cls.get_table_name() in tables:
+                return
+            column_families = {
+                column_family: dict()
+                for column_family in cls._codec.column_families
+            }
+            conn.create_table(cls.get_table_name(), column_families)
 
     @classmethod
     def serialize_row_key_from_tuple(cls, row_key_tuple):
@@ -196,15 +400,89 @@ class HBaseModel:
         return cls.serialize_row_key(data, is_prefix=True)
 
     @classmethod
-    def filter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False):
+    def get_scan_kwargs(cls, start=None, stop=None, prefix=None, columns=None, **kwargs):
         # serialize tuple to str
-        row_start = cls.serialize_row_key_from_tuple(start)
-        row_stop = cls.serialize_row_key_from_tuple(stop)
-        row_prefix = cls.serialize_row_key_from_tuple(prefix)
+        return {
+            'row_start': cls.serialize_row_key_from_tuple(start),
+            'row_stop': cls.serialize_row_key_from_tuple(stop),
+            'row_prefix': cls.serialize_row_key_from_tuple(prefix),
+            'columns': cls._codec.get_column_keys(columns),
+            **kwargs,
+        }
+
+    @classmethod
+    def get_column_value_filter(cls, field_name, value):
+        """
+        HBase filter string matching rows whose column equals value, rows
+        without the column are skipped
+        """
+        field = cls._codec.fields[field_name]
+        return "SingleColumnValueFilter('{}', '{}', =, 'binary:{}', true, true)".format(
+            field.column_family,
+            field_name,
+            cls._codec.encoders[field_name](value),
+        )
+
+    @classmethod
+    def scan(cls, batch_size=None, limit=None, reverse=False, **kwargs):
+        """
+        lazily scan the table page by page. each page of batch_size rows is
+        read with a connection that goes back to the pool before the rows are
+        yielded, so scans can interleave or be abandoned without holding one
+        """
+        batch_size = batch_size or settings.HBASE_SCAN_BATCH_SIZE
+        scan_kwargs = cls.get_scan_kwargs(reverse=reverse, **kwargs)
+        row_prefix = scan_kwargs.pop('row_prefix')
+        if row_prefix is not None:
+            # the bounds happybase derives from a prefix, the start moves on
+            # with every page
+            bounds = [row_prefix, bytes_increment(row_prefix)]
+            if reverse:
+                bounds.reverse()
+            scan_kwargs['row_start'], scan_kwargs['row_stop'] = bounds
 
+        last_row_key = None
+        rows_left = limit
+        while rows_left is None or rows_left > 0:
+            page_size = batch_size if rows_left is None else min(batch_size, rows_left)
+            if last_row_key is not None:
+                # the start row is inclusive, the last row is read again
+                scan_kwargs['row_start'] = last_row_key
+                page_size += 1
+            rows = cls.read_table(lambda table: list(table.scan(
+                batch_size=page_size,
+                limit=page_size,
+                **scan_kwargs,
+            )))
+            is_last_page = len(rows) < page_size
+            if last_row_key is not None and rows and rows[0][0] == last_row_key:
+                rows = rows[1:]
+            if not rows:
+                return
+            yield from rows
+            if is_last_page:
+                return
+            last_row_key = rows[-1][0]
+            if rows_left is not None:
+                rows_left -= len(rows)
+
+    @classmethod
+    def filter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False, columns=None, filter=None):
+        """
+        columns is an optional list of field names to fetch, filter is an
+        HBase filter string evaluated on the region servers
+        """
+        scan_kwargs = cls.get_scan_kwargs(
+            start=start,
+            stop=stop,
+            prefix=prefix,
+            limit=limit,
+            reverse=reverse,
+            columns=columns,
+            filter=filter,
+        )
         # scan table
-        table = cls.get_table()
-        rows = table.scan(row_start, row_stop, row_prefix, limit=limit, reverse=reverse)
+        rows = cls.read_table(lambda table: list(table.scan(**scan_kwargs)))
 
         # deserialize to instance list
         results = []
@@ -213,8 +491,98 @@ class HBaseModel:
             results.append(instance)
         return results
 
+    @classmethod
+    def iter_filter(cls, start=None, stop=None, prefix=None, limit=None, reverse=False,
+                    columns=None, filter=None, batch_size=None):
+        """
+        same as filter(), but instances are yielded one by one while the table
+        is scanned, so memory stays flat however many rows match
+        """
+        rows = cls.scan(
+            start=start,
+            stop=stop,
+            prefix=prefix,
+            limit=limit,
+            reverse=reverse,
+            columns=columns,
+            filter=filter,
+            batch_size=batch_size,
+        )
+        for row_key, row_data in rows:
+            yield cls.init_from_row(row_key, row_data)
+
+    @classmethod
+    def iter_values(cls, field_name, start=None, stop=None, prefix=None, limit=None, reverse=False, batch_size=None):
+        """
+        yield the value of a single field for each row. a row key field is
+        decoded from the row key only and no column value is transferred,
+        a column field is the only column fetched and decoded.
+        """
+        field = cls._codec.fields[field_name]
+        if field.column_family:
+            column_key = cls._codec.get_column_keys([field_name])[0]
+            scan_kwargs = {'columns': [field_name]}
+        else:
+            column_key = None
+            scan_kwargs = {'filter': b'FirstKeyOnlyFilter() AND KeyOnlyFilter()'}
+        rows = cls.scan(
+            start=start,
+            stop=stop,
+            prefix=prefix,
+            limit=limit,
+            reverse=reverse,
+            batch_size=batch_size,
+            **scan_kwargs,
+        )
+        decode = cls._codec.decoders[field_name]
+        if column_key is None:
+            for row_key, _ in rows:
+                yield cls._codec.decode_row_key_field(row_key, field_name)
+            return
+        column_key = column_key.encode('utf-8')
+        for _, row_data in rows:
+            yield decode(row_data[column_key])
+
+    @classmethod
+    def count(cls, start=None, stop=None, prefix=None, filter=None, batch_size=None):
+        """
+        count rows on the region servers, only empty key values of one cell
+        per row are sent back
+        """
+        if filter is None:
+            filter = 'FirstKeyOnlyFilter() AND KeyOnlyFilter()'
+        else:
+            filter = '({}) AND KeyOnlyFilter()'.format(filter)
+        rows = cls.scan(
+            start=start,
+            stop=stop,
+            prefix=prefix,
+            filter=filter,
+            batch_size=batch_size,
+        )
+        return sum(1 for _ in rows)
+
     @classmethod
     def delete(cls, **kwargs):
         row_key = cls.serialize_row_key(kwargs)
-        table = cls.get_table()
-        return table.delete(row_key)
+        with cls.get_table_batch() as table_batch:
+            table_batch.delete(row_key)
+
+    @classmethod
+    def bulk_create(cls, instances, batch_size=None):
+        # serialize all rows first, so nothing is written if any of them is invalid
+        rows = [(instance.row_key, instance.get_row_data()) for instance in instances]
+        with cls.get_table_batch(batch_size) as table_batch:
+            for row_key, row_data in rows:
+                table_batch.put(row_key, row_data)
+        return instances
+
+    @classmethod
+    def bulk_delete(cls, keys, batch_size=None):
+        """
+        keys is a list of row key dicts, as the kwargs of delete()
+        """
+        row_keys = [cls.serialize_row_key(key) for key in keys]
+        with cls.get_table_batch(batch_size) as table_batch:
+            for row_key in row_keys:
+                table_batch.delete(row_key)
@@ -1,10 +1,15 @@
 from django.contrib import admin
 
 from django.contrib import admin
-from friendships.models import Friendship
+from friendships.models import Friendship, FriendshipCount
 
 
 @admin.register(Friendship)
 class FriendshipAdmin(admin.ModelAdmin):
     list_display = ('id', 'from_user', 'to_user', 'created_at')
-    date_hierarchy = 'created_at'
\ No newline at end of file
+    date_hierarchy = 'created_at'
+
+
+@admin.register(FriendshipCount)
+class FriendshipCountAdmin(admin.ModelAdmin):
+    list_display = ('user', 'followers_count', 'followings_count')
@@ -23,10 +23,19 @@ class BaseFriendshipSerializer(serializers.Serializer):
     def _get_following_user_id_set(self):
         if self.context['request'].user.is_anonymous:
             return {}
+        # resolved by the view for the whole page
+        if 'followed_user_id_set' in self.context:
+            return self.context['followed_user_id_set']
         if hasattr(self, '_cached_following_user_id_set'):
             return self._cached_following_user_id_set
-        user_id_set = FriendshipService.get_following_user_id_set(
+        # only check the users on this page instead of loading all followings
+        if self.parent is None:
+            instances = [self.instance]
+        else:
+            instances = self.parent.instance
+        user_id_set = FriendshipService.get_followed_user_id_set(
             self.context['request'].user.id,
+            [self.get_user_id(obj) for obj in instances],
         )
         setattr(self, '_cached_following_user_id_set', user_id_set)
         return user_id_set
@@ -35,7 +44,10 @@ class BaseFriendshipSerializer(serializers.Serializer):
         return self.get_user_id(obj) in self._get_following_user_id_set()
 
     def get_user(self, obj):
-        user = UserService.get_user_by_id(self.get_user_id(obj))
+        user_id = self.get_user_id(obj)
+        user = self.context.get('users', {}).get(user_id)
+        if user is None:
+            user = UserService.get_user_by_id(user_id)
         return UserSerializerForFriendship(user).data
 
     def get_created_at(self, obj):
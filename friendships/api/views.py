@@ -2,6 +2,7 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from accounts.services import UserService
 from friendships.models import Friendship
 from friendships.services import FriendshipService
 from friendships.api.serializers import (
@@ -22,6 +23,20 @@ class FriendshipViewSet(viewsets.GenericViewSet):
     queryset = User.objects.all()
     pagination_class = EndlessPagination
 
+    def get_page_context(self, request, user_ids):
+        # hydrate the whole page up front, one round trip per data source
+        # instead of several for every row
+        context = {
+            'request': request,
+            'users': UserService.get_users_through_cache(user_ids),
+        }
+        if request.user.is_authenticated:
+            context['followed_user_id_set'] = FriendshipService.get_followed_user_id_set(
+                request.user.id,
+                user_ids,
+            )
+        return context
+
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
     @method_decorator(ratelimit(key='user_or_ip', rate='3/s', method='GET', block=True))
     def followers(self, request, pk):
@@ -31,7 +46,8 @@ class FriendshipViewSet(viewsets.GenericViewSet):
         else:
             friendships = Friendship.objects.filter(to_user_id=pk).order_by('-created_at')
             page = self.paginate_queryset(friendships)
-        serializer = FollowerSerializer(page, many=True, context={'request': request})
+        context = self.get_page_context(request, [obj.from_user_id for obj in page])
+        serializer = FollowerSerializer(page, many=True, context=context)
         return self.paginator.get_paginated_response(serializer.data)
 
     @action(methods=['GET'], detail=True, permission_classes=[AllowAny])
@@ -43,7 +59,8 @@ class FriendshipViewSet(viewsets.GenericViewSet):
         else:
             friendships = Friendship.objects.filter(from_user_id=pk).order_by('-created_at')
             page = self.paginate_queryset(friendships)
-        serializer = FollowingSerializer(page, many=True, context={'request': request})
+        context = self.get_page_context(request, [obj.to_user_id for obj in page])
+        serializer = FollowingSerializer(page, many=True, context=context)
         return self.paginator.get_paginated_response(serializer.data)
 
     @action(methods=['POST'], detail=True, permission_classes=[IsAuthenticated])
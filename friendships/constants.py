@@ -0,0 +1,2 @@
+# counts changed in redis first and flushed to db by flush_friendship_counts_task
+BUFFERED_FRIENDSHIP_COUNTS = ('followers_count', 'followings_count')
@@ -37,3 +37,21 @@ class HBaseFollower(models.HBaseModel):
     class Meta:
         row_key = ('to_user_id', 'created_at')
         table_name = 'twitter_followers'
+
+
+class HBaseFriendship(models.HBaseModel):
+    """
+    store one row per follow edge，row_key is from_user_id + to_user_id
+    can query：
+     - whether A followed B with a single row get
+     - when A followed B, to locate A's rows in followings and followers
+    """
+    # row key
+    from_user_id = models.IntegerField(reverse=True)
+    to_user_id = models.IntegerField()
+    # column key
+    created_at = models.TimestampField(column_family='cf')
+
+    class Meta:
+        table_name = 'twitter_friendships'
+        row_key = ('from_user_id', 'to_user_id')
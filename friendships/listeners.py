@@ -1,4 +1,13 @@
-def friendship_changed(sender, instance, **kwargs):
+def following_created(sender, instance, created, **kwargs):
+    if not created:
+        return
+
     # importing in the method to prevent circular dependency
     from friendships.services import FriendshipService
-    FriendshipService.invalidate_following_cache(instance.from_user_id)
+    FriendshipService.add_following_to_cache(instance.from_user_id, instance.to_user_id)
+
+
+def following_deleted(sender, instance, **kwargs):
+    # importing in the method to prevent circular dependency
+    from friendships.services import FriendshipService
+    FriendshipService.remove_following_from_cache(instance.from_user_id, instance.to_user_id)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django_hbase.models import HBaseModel
+from friendships.hbase_models import HBaseFollowing, HBaseFriendship
+from itertools import islice
+
+
+class Command(BaseCommand):
+    help = 'Build HBaseFriendship edge rows from the HBase followings table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = 0
+        # edges are put by row key, an interrupted run can simply be run again
+        followings = HBaseFollowing.iter_filter(batch_size=batch_size)
+        while True:
+            page = list(islice(followings, batch_size))
+            if not page:
+                break
+            with HBaseModel.batch(batch_size):
+                for following in page:
+                    HBaseFriendship.create(
+                        from_user_id=following.from_user_id,
+                        to_user_id=following.to_user_id,
+                        created_at=following.created_at,
+                    )
+            total += len(page)
+            self.stdout.write(f'{total} edges written')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} edges written'))
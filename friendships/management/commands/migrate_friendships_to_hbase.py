@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django_hbase.models import HBaseModel
+from friendships.hbase_models import HBaseFollowing, HBaseFollower, HBaseFriendship
+from friendships.models import Friendship
+from utils.time_helpers import datetime_to_timestamp
+
+
+class Command(BaseCommand):
+    help = 'Copy friendships from MySQL to HBase in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        # resume from the last id printed by an interrupted run, the rows of
+        # the batch that was interrupted are put again, which is harmless
+        parser.add_argument('--start-id', type=int, default=0)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = options['start_id']
+        total = 0
+        while True:
+            friendships = list(
+                Friendship.objects.filter(id__gt=last_id).order_by('id')[:batch_size]
+            )
+            if not friendships:
+                break
+
+            followings, followers, edges = [], [], []
+            for friendship in friendships:
+                data = {
+                    'from_user_id': friendship.from_user_id,
+                    'to_user_id': friendship.to_user_id,
+                    'created_at': datetime_to_timestamp(friendship.created_at),
+                }
+                followings.append(HBaseFollowing(**data))
+                followers.append(HBaseFollower(**data))
+                edges.append(HBaseFriendship(**data))
+
+            with HBaseModel.batch(batch_size):
+                HBaseFollowing.bulk_create(followings)
+                HBaseFollower.bulk_create(followers)
+                HBaseFriendship.bulk_create(edges)
+
+            last_id = friendships[-1].id
+            total += len(friendships)
+            self.stdout.write(f'{total} friendships migrated, last id {last_id}')
+
+        self.stdout.write(self.style.SUCCESS(f'Done, {total} friendships migrated'))
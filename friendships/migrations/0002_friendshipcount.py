@@ -0,0 +1,25 @@
+# Generated by Django 3.1.3 on 2026-10-18 10:12
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('friendships', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendshipCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('followers_count', models.IntegerField(default=0, null=True)),
+                ('followings_count', models.IntegerField(default=0, null=True)),
+                ('user', models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.3 on 2026-10-18 15:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def delete_counts_without_user(apps, schema_editor):
+    # the user becomes the primary key, rows of deleted users are dropped
+    FriendshipCount = apps.get_model('friendships', 'FriendshipCount')
+    FriendshipCount.objects.filter(user__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('friendships', '0002_friendshipcount'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FriendshipCountFlush',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('flush_id', models.CharField(max_length=32, unique=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RunPython(delete_counts_without_user, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='friendshipcount',
+            name='id',
+        ),
+        migrations.AlterField(
+            model_name='friendshipcount',
+            name='user',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to=settings.AUTH_USER_MODEL),
+        ),
+    ]
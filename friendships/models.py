@@ -1,7 +1,7 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save, pre_delete
-from friendships.listeners import friendship_changed
+from django.db.models.signals import post_save, post_delete
+from friendships.listeners import following_created, following_deleted
 from utils.memcached_helper import MemcachedHelper
 
 
@@ -41,6 +41,31 @@ class Friendship(models.Model):
         return MemcachedHelper.get_object_through_cache(User, self.to_user_id)
 
 
-# hook up with listeners to invalidate cache
-pre_delete.connect(friendship_changed, sender=Friendship)
-post_save.connect(friendship_changed, sender=Friendship)
+class FriendshipCount(models.Model):
+    # denormalized friendship counts of one user, redis is the read source.
+    # keyed by user, so the cached counts are found without reading the row
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True)
+    followers_count = models.IntegerField(default=0, null=True)
+    followings_count = models.IntegerField(default=0, null=True)
+
+    def __str__(self):
+        return '{} followers: {} followings: {}'.format(
+            self.user_id,
+            self.followers_count,
+            self.followings_count,
+        )
+
+
+class FriendshipCountFlush(models.Model):
+    # a flush of the buffered friendship counts that is committed to db, see
+    # RedisHelper.flush_buffered_counts
+    flush_id = models.CharField(max_length=32, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.created_at}: {self.flush_id}'
+
+
+# hook up with listeners to keep the cached following set up to date
+post_save.connect(following_created, sender=Friendship)
+post_delete.connect(following_deleted, sender=Friendship)
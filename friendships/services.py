@@ -1,50 +1,126 @@
-from django.conf import settings
-from django.core.cache import caches
-from friendships.models import Friendship
-from twitter.cache import FOLLOWINGS_PATTERN
+from django.db.models import Q
+from django_hbase.models import HBaseModel
+from friendships.models import Friendship, FriendshipCount
+from twitter.cache import USER_FOLLOWINGS_PATTERN
 from gatekeeper.models import GateKeeper
-from friendships.hbase_models import HBaseFollowing, HBaseFollower
+from friendships.hbase_models import HBaseFollowing, HBaseFollower, HBaseFriendship
+from utils.redis_helper import RedisHelper
+from utils.time_constants import MAX_TIMESTAMP
+from friendships.tasks import reconcile_friendship_count_task
 
 import time
 
-cache = caches['testing'] if settings.TESTING else caches['default']
-
 
 class FriendshipService(object):
 
     @classmethod
-    def get_follower_ids(cls, to_user_id):
+    def iter_follower_id_batches(cls, to_user_id, batch_size, cursor=None):
+        """
+        yield (follower_ids, cursor) batch by batch, oldest followers first.
+        every batch is a separate query or scan, pass the cursor of a batch
+        to resume after it
+        """
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            friendships = Friendship.objects.filter(to_user_id=to_user_id)
+            yield from cls._iter_mysql_follower_id_batches(to_user_id, batch_size, cursor)
         else:
-            friendships = HBaseFollower.filter(prefix=(to_user_id, None))
-        return [friendship.from_user_id for friendship in friendships]
+            yield from cls._iter_hbase_follower_id_batches(to_user_id, batch_size, cursor)
 
     @classmethod
-    def get_following_user_id_set(cls, from_user_id):
-        # <TODO> cache in redis set
+    def _iter_mysql_follower_id_batches(cls, to_user_id, batch_size, cursor):
+        # keyset pagination on (created_at, id) using the to_user_id index
+        queryset = Friendship.objects.filter(to_user_id=to_user_id).order_by('created_at', 'id')
+        while True:
+            page = queryset
+            if cursor is not None:
+                created_at, last_id = cursor
+                page = page.filter(
+                    Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=last_id)
+                )
+            rows = list(page.values_list('created_at', 'id', 'from_user_id')[:batch_size])
+            if not rows:
+                return
+            cursor = (rows[-1][0].isoformat(), rows[-1][1])
+            yield [from_user_id for _, _, from_user_id in rows], cursor
+            if len(rows) < batch_size:
+                return
+
+    @classmethod
+    def _iter_hbase_follower_id_batches(cls, to_user_id, batch_size, cursor):
+        # created_at is unique in the row keys of a user's followers
+        while True:
+            if cursor is None:
+                scan_kwargs = {'prefix': (to_user_id, None)}
+            else:
+                scan_kwargs = {
+                    'start': (to_user_id, cursor + 1),
+                    'stop': (to_user_id, MAX_TIMESTAMP),
+                }
+            followers = HBaseFollower.filter(
+                limit=batch_size,
+                columns=['from_user_id'],
+                **scan_kwargs,
+            )
+            if not followers:
+                return
+            cursor = followers[-1].created_at
+            yield [follower.from_user_id for follower in followers], cursor
+            if len(followers) < batch_size:
+                return
+
+    @classmethod
+    def load_following_user_ids(cls, from_user_id):
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             friendships = Friendship.objects.filter(from_user_id=from_user_id)
-        else:
-            friendships = HBaseFollowing.filter(prefix=(from_user_id, None))
-        user_id_set = set([
-            fs.to_user_id
-            for fs in friendships
-        ])
-        return user_id_set
+            return [fs.to_user_id for fs in friendships]
+        return list(HBaseFollowing.iter_values('to_user_id', prefix=(from_user_id, None)))
+
+    @classmethod
+    def get_following_user_id_set(cls, from_user_id):
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        return RedisHelper.load_id_set(
+            key,
+            lambda: cls.load_following_user_ids(from_user_id),
+        )
+
+    @classmethod
+    def get_followed_user_id_set(cls, from_user_id, user_ids):
+        """
+        which of user_ids are followed by from_user_id, only these ids are
+        checked against the cached following set
+        """
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        return RedisHelper.get_members_of_id_set(
+            key,
+            user_ids,
+            lambda: cls.load_following_user_ids(from_user_id),
+        )
+
+    @classmethod
+    def add_following_to_cache(cls, from_user_id, to_user_id):
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        RedisHelper.add_to_id_set(key, to_user_id)
+
+    @classmethod
+    def remove_following_from_cache(cls, from_user_id, to_user_id):
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        RedisHelper.remove_from_id_set(key, to_user_id)
 
     @classmethod
     def invalidate_following_cache(cls, from_user_id):
-        key = FOLLOWINGS_PATTERN.format(user_id=from_user_id)
-        cache.delete(key)
+        key = USER_FOLLOWINGS_PATTERN.format(user_id=from_user_id)
+        RedisHelper.invalidate_id_set(key)
 
     @classmethod
     def get_follow_instance(cls, from_user_id, to_user_id):
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        for follow in followings:
-            if follow.to_user_id == to_user_id:
-                return follow
-        return None
+        # the edge row tells when A followed B, no need to scan followings
+        friendship = HBaseFriendship.get(from_user_id=from_user_id, to_user_id=to_user_id)
+        if friendship is None:
+            return None
+        return HBaseFollowing(
+            from_user_id=from_user_id,
+            to_user_id=to_user_id,
+            created_at=friendship.created_at,
+        )
 
     @classmethod
     def has_followed(cls, from_user_id, to_user_id):
@@ -65,6 +141,12 @@ class FriendshipService(object):
         if from_user_id == to_user_id:
             return None
 
+        instance = cls.create_friendship(from_user_id, to_user_id)
+        cls.incr_friendship_counts(from_user_id, to_user_id)
+        return instance
+
+    @classmethod
+    def create_friendship(cls, from_user_id, to_user_id):
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             # create data in mysql
             return Friendship.objects.create(
@@ -72,24 +154,40 @@ class FriendshipService(object):
                 to_user_id=to_user_id,
             )
 
-        # create data in hbase
+        # create data in hbase, all rows are sent in one batch
         now = int(time.time() * 1000000)
-        HBaseFollower.create(
-            from_user_id=from_user_id,
-            to_user_id=to_user_id,
-            created_at=now,
-        )
-        return HBaseFollowing.create(
-            from_user_id=from_user_id,
-            to_user_id=to_user_id,
-            created_at=now,
-        )
+        with HBaseModel.batch():
+            HBaseFriendship.create(
+                from_user_id=from_user_id,
+                to_user_id=to_user_id,
+                created_at=now,
+            )
+            HBaseFollower.create(
+                from_user_id=from_user_id,
+                to_user_id=to_user_id,
+                created_at=now,
+            )
+            following = HBaseFollowing.create(
+                from_user_id=from_user_id,
+                to_user_id=to_user_id,
+                created_at=now,
+            )
+        # mysql friendships update the cache through listeners
+        cls.add_following_to_cache(from_user_id, to_user_id)
+        return following
 
     @classmethod
     def unfollow(cls, from_user_id, to_user_id):
         if from_user_id == to_user_id:
             return 0
 
+        deleted = cls.delete_friendship(from_user_id, to_user_id)
+        if deleted:
+            cls.decr_friendship_counts(from_user_id, to_user_id)
+        return deleted
+
+    @classmethod
+    def delete_friendship(cls, from_user_id, to_user_id):
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
             deleted, _ = Friendship.objects.filter(
                 from_user_id=from_user_id,
@@ -101,13 +199,77 @@ class FriendshipService(object):
         if instance is None:
             return 0
 
-        HBaseFollowing.delete(from_user_id=from_user_id, created_at=instance.created_at)
-        HBaseFollower.delete(to_user_id=to_user_id, created_at=instance.created_at)
+        with HBaseModel.batch():
+            HBaseFriendship.delete(from_user_id=from_user_id, to_user_id=to_user_id)
+            HBaseFollowing.delete(from_user_id=from_user_id, created_at=instance.created_at)
+            HBaseFollower.delete(to_user_id=to_user_id, created_at=instance.created_at)
+        cls.remove_following_from_cache(from_user_id, to_user_id)
         return 1
 
     @classmethod
-    def get_following_count(cls, from_user_id):
+    def count_friendships(cls, user_id):
+        # count from the source of truth, O(followers + followings)
         if not GateKeeper.is_switch_on('switch_friendship_to_hbase'):
-            return Friendship.objects.filter(from_user_id=from_user_id).count()
-        followings = HBaseFollowing.filter(prefix=(from_user_id, None))
-        return len(followings)
+            return {
+                'followers_count': Friendship.objects.filter(to_user_id=user_id).count(),
+                'followings_count': Friendship.objects.filter(from_user_id=user_id).count(),
+            }
+        return {
+            'followers_count': HBaseFollower.count(prefix=(user_id, None)),
+            'followings_count': HBaseFollowing.count(prefix=(user_id, None)),
+        }
+
+    @classmethod
+    def create_friendship_count(cls, user_id):
+        """
+        first use, the row starts from zero and the real counts are added by
+        a task, since counting them takes as long as there are friendships
+        """
+        _, created = FriendshipCount.objects.get_or_create(user_id=user_id)
+        if created:
+            reconcile_friendship_count_task.delay(user_id)
+
+    @classmethod
+    def get_friendship_count(cls, user_id, attr):
+        # redis first, the row is only read on a miss
+        friendship_count = FriendshipCount(user_id=user_id)
+        count = RedisHelper.get_counts([friendship_count], attr).get(user_id)
+        if count is not None:
+            return count
+        cls.create_friendship_count(user_id)
+        return RedisHelper.get_counts([friendship_count], attr).get(user_id)
+
+    @classmethod
+    def incr_friendship_counts(cls, from_user_id, to_user_id):
+        RedisHelper.incr_buffered_count(FriendshipCount(user_id=from_user_id), 'followings_count')
+        RedisHelper.incr_buffered_count(FriendshipCount(user_id=to_user_id), 'followers_count')
+
+    @classmethod
+    def decr_friendship_counts(cls, from_user_id, to_user_id):
+        RedisHelper.decr_buffered_count(FriendshipCount(user_id=from_user_id), 'followings_count')
+        RedisHelper.decr_buffered_count(FriendshipCount(user_id=to_user_id), 'followers_count')
+
+    @classmethod
+    def get_following_count(cls, from_user_id):
+        return cls.get_friendship_count(from_user_id, 'followings_count')
+
+    @classmethod
+    def get_follower_count(cls, to_user_id):
+        return cls.get_friendship_count(to_user_id, 'followers_count')
+
+    @classmethod
+    def reconcile_friendship_count(cls, user_id):
+        """
+        fix the drift between the denormalized counts and the source of truth,
+        e.g. friendships written without FriendshipService.
+        return True if the counts are fixed
+        """
+        fixed = False
+        for attr, count in cls.count_friendships(user_id).items():
+            # the cached count includes the deltas which are not flushed yet,
+            # the drift goes through the same buffer
+            drift = count - cls.get_friendship_count(user_id, attr)
+            if drift:
+                RedisHelper.change_buffered_count(FriendshipCount(user_id=user_id), attr, drift)
+                fixed = True
+        return fixed
@@ -0,0 +1,35 @@
+from celery import shared_task
+from django.conf import settings
+from friendships.constants import BUFFERED_FRIENDSHIP_COUNTS
+from friendships.models import FriendshipCount, FriendshipCountFlush
+from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_HOUR
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def reconcile_friendship_counts_task():
+    from friendships.services import FriendshipService
+
+    fixed = 0
+    user_ids = FriendshipCount.objects.order_by('pk').values_list('pk', flat=True)
+    for user_id in user_ids.iterator(chunk_size=1000):
+        if FriendshipService.reconcile_friendship_count(user_id):
+            fixed += 1
+    return '{} friendship counts fixed'.format(fixed)
+
+
+@shared_task(routing_key='default', time_limit=ONE_HOUR)
+def reconcile_friendship_count_task(user_id):
+    from friendships.services import FriendshipService
+
+    if FriendshipService.reconcile_friendship_count(user_id):
+        return 'friendship counts of {} fixed'.format(user_id)
+    return 'friendship counts of {} are right'.format(user_id)
+
+
+@shared_task(routing_key='default', time_limit=settings.REDIS_FLUSH_LOCK_TIMEOUT)
+def flush_friendship_counts_task():
+    flushed = 0
+    for attr in BUFFERED_FRIENDSHIP_COUNTS:
+        flushed += RedisHelper.flush_buffered_counts(FriendshipCount, attr, FriendshipCountFlush)
+    return '{} friendship counts flushed'.format(flushed)
@@ -1,8 +1,13 @@
-from django_hbase.models import EmptyColumnError, BadRowKeyError
-from friendships.hbase_models import HBaseFollowing, HBaseFollower
-from friendships.models import Friendship
+from django_hbase.client import HBaseClient
+from django_hbase.models import EmptyColumnError, BadRowKeyError, HBaseModel
+from friendships.hbase_models import HBaseFollowing, HBaseFollower, HBaseFriendship
+from gatekeeper.models import GateKeeper
+from friendships.models import Friendship, FriendshipCount
 from friendships.services import FriendshipService
+from friendships.tasks import flush_friendship_counts_task, reconcile_friendship_counts_task
 from testing_utils.testcases import TestCase
+from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
 
 import time
 
@@ -27,6 +32,146 @@ class FriendshipServiceTests(TestCase):
         user_id_set = FriendshipService.get_following_user_id_set(self.ray.id)
         self.assertSetEqual(user_id_set, {user1.id, user2.id})
 
+    def test_followed_user_id_set(self):
+        user1 = self.create_user('user1')
+        user2 = self.create_user('user2')
+        # empty sets are cached as well
+        self.assertSetEqual(FriendshipService.get_following_user_id_set(self.ray.id), set())
+        conn = RedisClient.get_connection()
+        self.assertEqual(conn.exists('user_followings:{}'.format(self.ray.id)), True)
+
+        # the cached set is updated instead of being reloaded
+        FriendshipService.follow(self.ray.id, user1.id)
+        FriendshipService.follow(self.ray.id, self.lux.id)
+        user_id_set = FriendshipService.get_followed_user_id_set(
+            self.ray.id,
+            [user1.id, user2.id, self.lux.id],
+        )
+        self.assertSetEqual(user_id_set, {user1.id, self.lux.id})
+        FriendshipService.unfollow(self.ray.id, user1.id)
+        user_id_set = FriendshipService.get_followed_user_id_set(
+            self.ray.id,
+            [user1.id, user2.id, self.lux.id],
+        )
+        self.assertSetEqual(user_id_set, {self.lux.id})
+
+        # a follow doesn't create a partial set which isn't cached yet
+        FriendshipService.follow(self.lux.id, user2.id)
+        self.assertEqual(conn.exists('user_followings:{}'.format(self.lux.id)), False)
+        user_id_set = FriendshipService.get_followed_user_id_set(self.lux.id, [user2.id])
+        self.assertSetEqual(user_id_set, {user2.id})
+
+        # the same for friendships in hbase
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        FriendshipService.invalidate_following_cache(self.ray.id)
+        self.assertSetEqual(FriendshipService.get_following_user_id_set(self.ray.id), set())
+        FriendshipService.follow(self.ray.id, user2.id)
+        self.assertSetEqual(FriendshipService.get_following_user_id_set(self.ray.id), {user2.id})
+        FriendshipService.unfollow(self.ray.id, user2.id)
+        self.assertSetEqual(FriendshipService.get_following_user_id_set(self.ray.id), set())
+
+        # a fill that read db before a concurrent follow doesn't cache the
+        # outdated members
+        FriendshipService.invalidate_following_cache(self.ray.id)
+
+        def load_ids_then_follow():
+            ids = FriendshipService.load_following_user_ids(self.ray.id)
+            FriendshipService.follow(self.ray.id, user2.id)
+            return ids
+
+        key = 'user_followings:{}'.format(self.ray.id)
+        self.assertSetEqual(RedisHelper.load_id_set(key, load_ids_then_follow), set())
+        self.assertEqual(conn.exists(key), False)
+        self.assertSetEqual(FriendshipService.get_following_user_id_set(self.ray.id), {user2.id})
+
+    def test_iter_follower_id_batches(self):
+        for switch in [0, 100]:
+            GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', switch)
+            users = [self.create_user('user{}_{}'.format(switch, i)) for i in range(5)]
+            for user in users:
+                FriendshipService.follow(user.id, self.lux.id)
+
+            batches = list(FriendshipService.iter_follower_id_batches(self.lux.id, 2))
+            self.assertEqual(
+                [follower_ids for follower_ids, _ in batches],
+                [[users[0].id, users[1].id], [users[2].id, users[3].id], [users[4].id]],
+            )
+            # resume after the first batch
+            batches = FriendshipService.iter_follower_id_batches(self.lux.id, 3, batches[0][1])
+            self.assertEqual(
+                [follower_ids for follower_ids, _ in batches],
+                [[users[2].id, users[3].id, users[4].id]],
+            )
+            for user in users:
+                FriendshipService.unfollow(user.id, self.lux.id)
+
+    def test_friendship_counts(self):
+        self.assertEqual(FriendshipService.get_follower_count(self.lux.id), 0)
+        self.assertEqual(FriendshipService.get_following_count(self.ray.id), 0)
+
+        FriendshipService.follow(self.ray.id, self.lux.id)
+        self.assertEqual(FriendshipService.get_follower_count(self.lux.id), 1)
+        self.assertEqual(FriendshipService.get_following_count(self.ray.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.ray.id), 0)
+        # cached counts are keyed by user and read without touching the db
+        key = RedisHelper.get_count_key(FriendshipCount(user_id=self.lux.id), 'followers_count')
+        self.assertEqual(key, 'FriendshipCount.followers_count:{}'.format(self.lux.id))
+        with self.assertNumQueries(0):
+            self.assertEqual(FriendshipService.get_follower_count(self.lux.id), 1)
+
+        # the db rows are updated by the flush
+        count = FriendshipCount.objects.get(user=self.lux)
+        self.assertEqual(count.followers_count, 0)
+        self.assertEqual(flush_friendship_counts_task(), '2 friendship counts flushed')
+        count = FriendshipCount.objects.get(user=self.lux)
+        self.assertEqual(count.followers_count, 1)
+        self.assertEqual(FriendshipService.get_follower_count(self.lux.id), 1)
+
+        # unfollow twice only decreases once
+        FriendshipService.unfollow(self.ray.id, self.lux.id)
+        FriendshipService.unfollow(self.ray.id, self.lux.id)
+        self.assertEqual(FriendshipService.get_follower_count(self.lux.id), 0)
+        self.assertEqual(FriendshipService.get_following_count(self.ray.id), 0)
+
+        # friendships written around the service drift until reconciled
+        Friendship.objects.create(from_user=self.ray, to_user=self.lux)
+        self.assertEqual(FriendshipService.get_follower_count(self.lux.id), 0)
+        self.assertEqual(reconcile_friendship_counts_task(), '2 friendship counts fixed')
+        self.assertEqual(FriendshipService.get_follower_count(self.lux.id), 1)
+        self.assertEqual(FriendshipService.get_following_count(self.ray.id), 1)
+        self.assertEqual(reconcile_friendship_counts_task(), '0 friendship counts fixed')
+
+        # the first read of a user with friendships counts them in a task
+        zoe = self.create_user('zoe')
+        Friendship.objects.create(from_user=zoe, to_user=self.lux)
+        self.assertEqual(FriendshipService.get_following_count(zoe.id), 1)
+        self.assertEqual(FriendshipService.get_follower_count(zoe.id), 0)
+
+    def test_follow_edges_in_hbase(self):
+        GateKeeper.set_kv('switch_friendship_to_hbase', 'percent', 100)
+        self.assertEqual(FriendshipService.has_followed(self.ray.id, self.lux.id), False)
+
+        following = FriendshipService.follow(self.ray.id, self.lux.id)
+        self.assertEqual(FriendshipService.has_followed(self.ray.id, self.lux.id), True)
+        self.assertEqual(FriendshipService.has_followed(self.lux.id, self.ray.id), False)
+        edge = HBaseFriendship.get(from_user_id=self.ray.id, to_user_id=self.lux.id)
+        self.assertEqual(edge.created_at, following.created_at)
+        instance = FriendshipService.get_follow_instance(self.ray.id, self.lux.id)
+        self.assertEqual(instance.created_at, following.created_at)
+
+        self.assertEqual(FriendshipService.unfollow(self.ray.id, self.lux.id), 1)
+        self.assertEqual(FriendshipService.has_followed(self.ray.id, self.lux.id), False)
+        self.assertEqual(HBaseFriendship.get(from_user_id=self.ray.id, to_user_id=self.lux.id), None)
+        self.assertEqual(
+            HBaseFollowing.get(from_user_id=self.ray.id, created_at=following.created_at),
+            None,
+        )
+        self.assertEqual(
+            HBaseFollower.get(to_user_id=self.lux.id, created_at=following.created_at),
+            None,
+        )
+        self.assertEqual(FriendshipService.unfollow(self.ray.id, self.lux.id), 0)
+
 
 class HBaseTests(TestCase):
 
@@ -134,3 +279,166 @@ class HBaseTests(TestCase):
         self.assertEqual(len(results), 2)
         self.assertEqual(results[0].to_user_id, 3)
         self.assertEqual(results[1].to_user_id, 2)
+
+    def test_codec(self):
+        ts = self.ts_now
+        following = HBaseFollowing(from_user_id=123, to_user_id=34, created_at=ts)
+        # fields are stored in slots instead of instance __dict__
+        self.assertEqual(hasattr(following, '__dict__'), False)
+        self.assertEqual(following.row_key, bytes('3210000000000000:{}'.format(ts), 'utf-8'))
+        self.assertEqual(
+            HBaseFollowing.serialize_row_data(following.get_field_values()),
+            {'cf:to_user_id': '0000000000000034'},
+        )
+        self.assertEqual(
+            HBaseFollowing.deserialize_row_key(following.row_key),
+            {'from_user_id': 123, 'created_at': ts},
+        )
+        self.assertEqual(
+            HBaseFollowing.deserialize_row_key(b'3210000000000000'),
+            {'from_user_id': 123},
+        )
+
+        instance = HBaseFollowing.init_from_row(
+            following.row_key,
+            {b'cf:to_user_id': b'0000000000000034'},
+        )
+        self.assertEqual(instance.get_field_values(), following.get_field_values())
+
+    def test_connection_pool(self):
+        stats = HBaseClient.get_stats()
+        with HBaseClient.get_connection() as conn:
+            # nested checkout in the same thread reuses the connection
+            with HBaseClient.get_connection() as nested_conn:
+                self.assertEqual(conn is nested_conn, True)
+            self.assertEqual(HBaseClient.get_stats()['in_use'], stats['in_use'] + 1)
+        self.assertEqual(HBaseClient.get_stats()['in_use'], stats['in_use'])
+        self.assertEqual(HBaseClient.get_stats()['checkouts'], stats['checkouts'] + 1)
+
+        HBaseFollowing.get(from_user_id=1, created_at=self.ts_now)
+        self.assertEqual(HBaseClient.get_stats()['checkouts'], stats['checkouts'] + 2)
+        self.assertEqual(HBaseClient.get_stats()['in_use'], stats['in_use'])
+
+    def test_bulk_create_and_delete(self):
+        ts = self.ts_now
+        followings = [
+            HBaseFollowing(from_user_id=1, to_user_id=to_user_id, created_at=ts + to_user_id)
+            for to_user_id in range(2, 7)
+        ]
+        HBaseFollowing.bulk_create(followings, batch_size=2)
+        results = HBaseFollowing.filter(prefix=(1, None))
+        self.assertEqual([f.to_user_id for f in results], [2, 3, 4, 5, 6])
+
+        # nothing is written if any instance is invalid
+        try:
+            HBaseFollowing.bulk_create([
+                HBaseFollowing(from_user_id=2, to_user_id=3, created_at=ts),
+                HBaseFollowing(from_user_id=2, created_at=ts + 1),
+            ])
+            exception_raised = False
+        except EmptyColumnError:
+            exception_raised = True
+        self.assertEqual(exception_raised, True)
+        self.assertEqual(len(HBaseFollowing.filter(prefix=(2, None))), 0)
+
+        HBaseFollowing.bulk_delete([
+            {'from_user_id': 1, 'created_at': ts + 2},
+            {'from_user_id': 1, 'created_at': ts + 3},
+        ])
+        results = HBaseFollowing.filter(prefix=(1, None))
+        self.assertEqual([f.to_user_id for f in results], [4, 5, 6])
+
+    def test_batch_scope(self):
+        ts = self.ts_now
+        with HBaseModel.batch():
+            HBaseFollower.create(from_user_id=1, to_user_id=2, created_at=ts)
+            HBaseFollowing.create(from_user_id=1, to_user_id=2, created_at=ts)
+            # writes are buffered until the scope exits
+            self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=ts), None)
+        self.assertEqual(HBaseFollowing.get(from_user_id=1, created_at=ts).to_user_id, 2)
+        self.assertEqual(HBaseFollower.get(to_user_id=2, created_at=ts).from_user_id, 1)
+
+        # mutations not sent yet are dropped if the scope fails
+        try:
+            with HBaseModel.batch():
+                HBaseFollowing.delete(from_user_id=1, created_at=ts)
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertNotEqual(HBaseFollowing.get(from_user_id=1, created_at=ts), None)
+
+    def test_get_many(self):
+        ts = self.ts_now
+        for to_user_id in range(2, 5):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=ts + to_user_id)
+
+        self.assertEqual(HBaseFollowing.get_many([]), [])
+        # results keep the order of keys, None for missing rows
+        results = HBaseFollowing.get_many([
+            {'from_user_id': 1, 'created_at': ts + 4},
+            {'from_user_id': 1, 'created_at': ts},
+            {'from_user_id': 1, 'created_at': ts + 2},
+        ])
+        self.assertEqual(results[0].to_user_id, 4)
+        self.assertEqual(results[1], None)
+        self.assertEqual(results[2].to_user_id, 2)
+        self.assertEqual(results[2].created_at, ts + 2)
+
+        results = HBaseFollowing.get_many(
+            [{'from_user_id': 1, 'created_at': ts + 3}],
+            columns=['to_user_id'],
+        )
+        self.assertEqual(results[0].to_user_id, 3)
+
+    def test_iter_filter_and_values(self):
+        ts = self.ts_now
+        for to_user_id in range(2, 6):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=ts + to_user_id)
+        HBaseFollowing.create(from_user_id=2, to_user_id=1, created_at=ts)
+
+        results = HBaseFollowing.iter_filter(prefix=(1, None), batch_size=2)
+        self.assertEqual(isinstance(results, list), False)
+        self.assertEqual([f.to_user_id for f in results], [2, 3, 4, 5])
+        results = HBaseFollowing.iter_filter(prefix=(1, None), limit=2, reverse=True)
+        self.assertEqual([f.to_user_id for f in results], [5, 4])
+
+        # column field
+        values = HBaseFollowing.iter_values('to_user_id', prefix=(1, None), batch_size=3)
+        self.assertEqual(list(values), [2, 3, 4, 5])
+        # row key field
+        values = HBaseFollowing.iter_values('created_at', prefix=(1, None))
+        self.assertEqual(list(values), [ts + 2, ts + 3, ts + 4, ts + 5])
+        values = HBaseFollowing.iter_values('from_user_id', prefix=(2, None))
+        self.assertEqual(list(values), [2])
+
+        # scans hold no connection between pages, so they can interleave
+        # or be abandoned halfway
+        a = HBaseFollowing.iter_values('to_user_id', prefix=(1, None), batch_size=1)
+        b = HBaseFollowing.iter_values('to_user_id', prefix=(1, None), batch_size=1, reverse=True)
+        self.assertEqual(list(zip(a, b)), [(2, 5), (3, 4), (4, 3), (5, 2)])
+        next(HBaseFollowing.iter_filter(prefix=(1, None), batch_size=1))
+        self.assertEqual(HBaseClient.get_stats()['in_use'], 0)
+
+    def test_server_side_filter_and_count(self):
+        ts = self.ts_now
+        for to_user_id in range(2, 6):
+            HBaseFollowing.create(from_user_id=1, to_user_id=to_user_id, created_at=ts + to_user_id)
+
+        results = HBaseFollowing.filter(
+            prefix=(1, None),
+            filter=HBaseFollowing.get_column_value_filter('to_user_id', 4),
+        )
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].to_user_id, 4)
+        self.assertEqual(results[0].created_at, ts + 4)
+
+        # column projection
+        results = HBaseFollowing.filter(prefix=(1, None), columns=['to_user_id'], limit=1)
+        self.assertEqual(results[0].to_user_id, 2)
+
+        self.assertEqual(HBaseFollowing.count(prefix=(1, None)), 4)
+        self.assertEqual(HBaseFollowing.count(prefix=(2, None)), 0)
+        self.assertEqual(HBaseFollowing.count(
+            prefix=(1, None),
+            filter=HBaseFollowing.get_column_value_filter('to_user_id', 5),
+        ), 1)
@@ -0,0 +1,15 @@
+from gatekeeper.models import GateKeeper
+
+
+class GateKeeperMiddleware:
+    """
+    gatekeepers are read at most once per request, the services and views
+    checking the same switch again get the memoized value
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with GateKeeper.memoize():
+            return self.get_response(request)
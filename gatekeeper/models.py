@@ -1,26 +1,74 @@
+from contextlib import contextmanager
+from django.conf import settings
+from utils.local_cache import local_cache
 from utils.redis_client import RedisClient
 
+import threading
+
 
 class GateKeeper(object):
+    # values read during the current request, see GateKeeperMiddleware
+    local = threading.local()
 
     @classmethod
-    def get(cls, gk_name):
-        conn = RedisClient.get_connection()
+    @contextmanager
+    def memoize(cls):
+        """
+        read every gatekeeper at most once in the block, so a request sees
+        the same value for a switch from start to end
+        """
+        cls.local.memo = {}
+        try:
+            yield
+        finally:
+            cls.local.memo = None
+
+    @classmethod
+    def _get_hash(cls, gk_name):
+        # per request memo, then the process wide cache, then redis
         name = f'gatekeeper:{gk_name}'
-        if not conn.exists(name):
+        memo = getattr(cls.local, 'memo', None)
+        if memo is not None and name in memo:
+            return memo[name]
+
+        redis_hash = local_cache.get(name)
+        if redis_hash is None:
+            conn = RedisClient.get_connection()
+            # empty if the gatekeeper does not exist
+            redis_hash = conn.hgetall(name)
+            local_cache.set(name, redis_hash, settings.GATEKEEPER_CACHE_TTL)
+        if memo is not None:
+            memo[name] = redis_hash
+        return redis_hash
+
+    @classmethod
+    def get(cls, gk_name):
+        redis_hash = cls._get_hash(gk_name)
+        if not redis_hash:
             return {'percent': 0, 'description': ''}
 
-        redis_hash = conn.hgetall(name)
         return {
             'percent': int(redis_hash.get(b'percent', 0)),
             'description': str(redis_hash.get(b'description', '')),
         }
 
+    @classmethod
+    def get_kv(cls, gk_name, key, default=None):
+        value = cls._get_hash(gk_name).get(key.encode('utf-8'))
+        if value is None:
+            return default
+        return value.decode('utf-8')
+
     @classmethod
     def set_kv(cls, gk_name, key, value):
         conn = RedisClient.get_connection()
         name = f'gatekeeper:{gk_name}'
         conn.hset(name, key, value)
+        # the other processes drop it as well instead of waiting for the ttl
+        local_cache.invalidate(name)
+        memo = getattr(cls.local, 'memo', None)
+        if memo is not None:
+            memo.pop(name, None)
 
     @classmethod
     def is_switch_on(cls, gk_name):
@@ -1,5 +1,7 @@
-from testing.testcases import TestCase
+from testing_utils.testcases import TestCase
 from gatekeeper.models import GateKeeper
+from utils.local_cache import local_cache
+from utils.redis_client import RedisClient
 
 
 class GateKeeperTests(TestCase):
@@ -20,3 +22,22 @@ class GateKeeperTests(TestCase):
         GateKeeper.set_kv('gk_name', 'percent', 100)
         self.assertEqual(GateKeeper.is_switch_on('gk_name'), True)
         self.assertEqual(GateKeeper.in_gk('gk_name', 1), True)
+
+    def test_gatekeeper_cache(self):
+        GateKeeper.set_kv('gk_name', 'percent', 100)
+        self.assertEqual(GateKeeper.is_switch_on('gk_name'), True)
+
+        # read from the local cache until it is changed through set_kv
+        conn = RedisClient.get_connection()
+        conn.hset('gatekeeper:gk_name', 'percent', 0)
+        self.assertEqual(GateKeeper.is_switch_on('gk_name'), True)
+        GateKeeper.set_kv('gk_name', 'percent', 20)
+        self.assertEqual(GateKeeper.get('gk_name')['percent'], 20)
+
+        # the value stays the same within a request
+        with GateKeeper.memoize():
+            self.assertEqual(GateKeeper.get_kv('gk_name', 'percent'), '20')
+            local_cache.clear()
+            conn.hset('gatekeeper:gk_name', 'percent', 0)
+            self.assertEqual(GateKeeper.get_kv('gk_name', 'percent'), '20')
+        self.assertEqual(GateKeeper.get_kv('gk_name', 'percent'), '0')
@@ -8,12 +8,18 @@ from tweets.models import Tweet
 
 
 class LikeSerializer(serializers.ModelSerializer):
-    user = UserSerializerForLike(source='cached_user')
+    user = serializers.SerializerMethodField()
 
     class Meta:
         model = Like
         fields = ('user', 'created_at')
 
+    def get_user(self, obj):
+        user = self.context.get('users', {}).get(obj.user_id)
+        if user is None:
+            user = obj.cached_user
+        return UserSerializerForLike(user).data
+
 
 class BaseLikeSerializerForCreateAndCancel(serializers.ModelSerializer):
     content_type = serializers.ChoiceField(choices=['comment', 'tweet'])
@@ -1,4 +1,5 @@
 from testing_utils.testcases import TestCase
+from tweets.tasks import flush_tweet_counts_task
 
 
 LIKE_BASE_URL = '/api/likes/'
@@ -232,12 +233,14 @@ class LikeApiTests(TestCase):
             # check tweet api
             response = client.get(tweet_url)
             self.assertEqual(response.data['likes_count'], i + 1)
+            flush_tweet_counts_task()
             tweet.refresh_from_db()
             self.assertEqual(tweet.likes_count, i + 1)
 
         self.lux_client.post(LIKE_BASE_URL, data)
         response = self.lux_client.get(tweet_url)
         self.assertEqual(response.data['likes_count'], 4)
+        flush_tweet_counts_task()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 4)
 
@@ -250,6 +253,7 @@ class LikeApiTests(TestCase):
 
         # lux canceled likes
         self.lux_client.post(LIKE_BASE_URL + 'cancel/', data)
+        flush_tweet_counts_task()
         tweet.refresh_from_db()
         self.assertEqual(tweet.likes_count, 3)
         response = self.lux_client.get(tweet_url)
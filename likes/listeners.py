@@ -3,7 +3,6 @@ from utils.redis_helper import RedisHelper
 
 def incr_likes_count(sender, instance, created, **kwargs):
     from tweets.models import Tweet
-    from django.db.models import F
 
     if not created:
         return
@@ -12,18 +11,16 @@ def incr_likes_count(sender, instance, created, **kwargs):
     if model_class != Tweet:
         return
 
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') + 1)
-    RedisHelper.incr_count(instance.content_object, 'likes_count')
+    # written to db in batches by flush_tweet_counts_task
+    RedisHelper.incr_buffered_count(Tweet(id=instance.object_id), 'likes_count')
 
 
 def decr_likes_count(sender, instance, **kwargs):
     from tweets.models import Tweet
-    from django.db.models import F
 
     model_class = instance.content_type.model_class()
     if model_class != Tweet:
         return
 
     # handle tweet likes cancel
-    Tweet.objects.filter(id=instance.object_id).update(likes_count=F('likes_count') - 1)
-    RedisHelper.decr_count(instance.content_object, 'likes_count')
\ No newline at end of file
+    RedisHelper.decr_buffered_count(Tweet(id=instance.object_id), 'likes_count')
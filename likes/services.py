@@ -13,3 +13,16 @@ class LikeService(object):
             object_id=target.id,
             user=user,
         ).exists()
+
+    @classmethod
+    def get_liked_object_ids(cls, user, model_class, object_ids):
+        """
+        batch version of has_liked, one query for the objects of a page
+        """
+        if user.is_anonymous:
+            return set()
+        return set(Like.objects.filter(
+            content_type=ContentType.objects.get_for_model(model_class),
+            object_id__in=object_ids,
+            user=user,
+        ).values_list('object_id', flat=True))
@@ -4,8 +4,14 @@ from tweets.api.serializers import TweetSerializer
 
 
 class NewsFeedSerializer(serializers.ModelSerializer):
-    tweet = TweetSerializer(source='cached_tweet')
+    tweet = serializers.SerializerMethodField()
 
     class Meta:
         model = NewsFeed
         fields = ('id', 'created_at', 'tweet')
+
+    def get_tweet(self, obj):
+        tweet = self.context.get('tweets', {}).get(obj.tweet_id)
+        if tweet is None:
+            tweet = obj.cached_tweet
+        return TweetSerializer(tweet, context=self.context).data
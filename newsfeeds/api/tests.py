@@ -3,7 +3,9 @@ from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
 from rest_framework.test import APIClient
 from testing_utils.testcases import TestCase
+from twitter.cache import USER_NEWSFEEDS_PATTERN
 from utils.paginations import EndlessPagination
+from utils.redis_client import RedisClient
 
 
 NEWSFEEDS_URL = '/api/newsfeeds/'
@@ -174,8 +176,9 @@ class NewsFeedApiTests(TestCase):
         newsfeeds = newsfeeds[::-1]
 
         # only cached list_limit objects
-        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(self.ray.id)
-        self.assertEqual(len(cached_newsfeeds), list_limit)
+        NewsFeedService.load_timeline(self.ray.id, limit=page_size)
+        key = USER_NEWSFEEDS_PATTERN.format(user_id=self.ray.id)
+        self.assertEqual(RedisClient.get_connection().zcard(key), list_limit)
         queryset = NewsFeed.objects.filter(user=self.ray)
         self.assertEqual(queryset.count(), list_limit + page_size)
 
@@ -4,6 +4,9 @@ from newsfeeds.api.serializers import NewsFeedSerializer
 from utils.paginations import EndlessPagination
 from newsfeeds.services import NewsFeedService
 from newsfeeds.models import NewsFeed
+from tweets.api.serializers import TweetSerializer
+from tweets.models import Tweet
+from utils.memcached_helper import MemcachedHelper
 from django.utils.decorators import method_decorator
 from ratelimit.decorators import ratelimit
 
@@ -17,14 +20,15 @@ class NewsFeedViewSet(viewsets.GenericViewSet):
 
     @method_decorator(ratelimit(key='user', rate='5/s', method='GET', block=True))
     def list(self, request):
-        cached_newsfeeds = NewsFeedService.get_cached_newsfeeds(request.user.id)
-        page = self.paginator.paginate_cached_list(cached_newsfeeds, request)
-        if page is None:
-            queryset = NewsFeed.objects.filter(user=request.user)
-            page = self.paginate_queryset(queryset)
-        serializer = NewsFeedSerializer(
-            page,
-            context={'request': request},
-            many=True,
+        page = self.paginator.paginate_cached_timeline(
+            lambda **kwargs: NewsFeedService.load_timeline(request.user.id, **kwargs),
+            request,
         )
+        tweets = MemcachedHelper.get_objects_through_cache(
+            Tweet,
+            [newsfeed.tweet_id for newsfeed in page],
+        )
+        context = TweetSerializer.get_page_context(request, tweets.values())
+        context['tweets'] = tweets
+        serializer = NewsFeedSerializer(page, context=context, many=True)
         return self.get_paginated_response(serializer.data)
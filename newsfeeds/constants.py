@@ -1,3 +1,10 @@
 from django.conf import settings
 
 FANOUT_BATCH_SIZE = 1000 if not settings.TESTING else 3
+# newsfeeds are small enough to be cached entirely in the lists
+CACHED_NEWSFEED_FIELDS = ('id', 'user_id', 'tweet_id', 'created_at')
+
+# authors with at least this many followers skip fanout when hybrid fanout is
+# on, overridden by the 'threshold' key of the gatekeeper
+HYBRID_FANOUT_GK = 'switch_newsfeed_hybrid_fanout'
+CELEBRITY_FOLLOWERS_THRESHOLD = 100000
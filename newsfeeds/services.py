@@ -1,9 +1,29 @@
+from accounts.services import UserService
 from friendships.services import FriendshipService
+from gatekeeper.models import GateKeeper
+from newsfeeds.constants import (
+    HYBRID_FANOUT_GK,
+    CELEBRITY_FOLLOWERS_THRESHOLD,
+    CACHED_NEWSFEED_FIELDS,
+)
 from newsfeeds.models import NewsFeed
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from tweets.models import Tweet
+from tweets.services import TweetService
+from twitter.cache import (
+    USER_NEWSFEEDS_PATTERN,
+    CELEBRITY_USER_IDS_KEY,
+    CELEBRITY_SINCE_TWEET_IDS_KEY,
+    FANOUT_PROGRESS_PATTERN,
+    FANOUT_CHECKPOINT_PATTERN,
+)
+from utils.redis_client import RedisClient
 from utils.redis_helper import RedisHelper
+from utils.time_constants import ONE_DAY
 from newsfeeds.tasks import fanout_newsfeeds_main_task
 
+import heapq
+import json
+
 
 class NewsFeedService(object):
 
@@ -12,13 +32,164 @@ class NewsFeedService(object):
         fanout_newsfeeds_main_task.delay(tweet.id, tweet.user_id)
 
     @classmethod
-    def get_cached_newsfeeds(cls, user_id):
+    def is_celebrity(cls, user_id):
+        if not GateKeeper.in_gk(HYBRID_FANOUT_GK, user_id):
+            return False
+        threshold = int(GateKeeper.get_kv(
+            HYBRID_FANOUT_GK,
+            'threshold',
+            CELEBRITY_FOLLOWERS_THRESHOLD,
+        ))
+        return FriendshipService.get_follower_count(user_id) >= threshold
+
+    @classmethod
+    def add_celebrity(cls, user_id, tweet_id):
+        # remember the first tweet that skipped fanout, the ones since then
+        # are pushed if the user stops being a celebrity
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline()
+        pipeline.sadd(CELEBRITY_USER_IDS_KEY, user_id)
+        pipeline.hsetnx(CELEBRITY_SINCE_TWEET_IDS_KEY, user_id, tweet_id)
+        pipeline.execute()
+
+    @classmethod
+    def remove_celebrity(cls, user_id, exclude_tweet_id=None):
+        """
+        the user dropped below the threshold, followers stop pulling its
+        tweets and the ones that skipped fanout are fanned out instead.
+        returns how many tweets are fanned out again
+        """
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline()
+        pipeline.srem(CELEBRITY_USER_IDS_KEY, user_id)
+        pipeline.hget(CELEBRITY_SINCE_TWEET_IDS_KEY, user_id)
+        pipeline.hdel(CELEBRITY_SINCE_TWEET_IDS_KEY, user_id)
+        removed, since_tweet_id, _ = pipeline.execute()
+        # only the task that removed it fans out again
+        if not removed:
+            return 0
+
+        tweets = Tweet.objects.filter(user_id=user_id)
+        if since_tweet_id is not None:
+            tweets = tweets.filter(id__gte=int(since_tweet_id))
+        tweet_ids = [
+            tweet_id
+            for tweet_id in tweets.values_list('id', flat=True)
+            if tweet_id != exclude_tweet_id
+        ]
+        for tweet_id in tweet_ids:
+            fanout_newsfeeds_main_task.delay(tweet_id, user_id, backfill=True)
+        return len(tweet_ids)
+
+    @classmethod
+    def get_followed_celebrity_ids(cls, user_id):
+        conn = RedisClient.get_connection()
+        celebrity_ids = [int(celebrity_id) for celebrity_id in conn.smembers(CELEBRITY_USER_IDS_KEY)]
+        return FriendshipService.get_followed_user_id_set(user_id, celebrity_ids)
+
+    @classmethod
+    def load_timeline(cls, user_id, max_timestamp=None, min_timestamp=None, limit=None):
+        """
+        a window of the newsfeeds merged with the tweets of followed
+        celebrities, see RedisHelper.load_timeline
+        """
         queryset = NewsFeed.objects.filter(user_id=user_id).order_by('-created_at')
         key = USER_NEWSFEEDS_PATTERN.format(user_id=user_id)
-        return RedisHelper.load_objects(key, queryset)
+        window = {
+            'max_timestamp': max_timestamp,
+            'min_timestamp': min_timestamp,
+            'limit': limit,
+        }
+        newsfeeds = RedisHelper.load_timeline(key, queryset, CACHED_NEWSFEED_FIELDS, **window)
+
+        celebrity_ids = cls.get_followed_celebrity_ids(user_id)
+        if not celebrity_ids:
+            return newsfeeds
+        celebrity_timelines = [
+            TweetService.load_timeline(celebrity_id, **window)
+            for celebrity_id in celebrity_ids
+        ]
+        return cls.merge_celebrity_tweets(user_id, newsfeeds, celebrity_timelines)[:limit]
+
+    @classmethod
+    def merge_celebrity_tweets(cls, user_id, newsfeeds, celebrity_timelines):
+        """
+        merge the pushed newsfeeds with the timelines of followed celebrities,
+        newest first. pulled tweets become unsaved newsfeeds
+        """
+        timelines = [newsfeeds]
+        for tweets in celebrity_timelines:
+            timelines.append([
+                NewsFeed(user_id=user_id, tweet_id=tweet.id, created_at=tweet.created_at)
+                for tweet in tweets
+            ])
+
+        merged, tweet_ids = [], set()
+        for newsfeed in heapq.merge(*timelines, key=lambda feed: feed.created_at, reverse=True):
+            # tweets pushed before the author became a celebrity show up twice
+            if newsfeed.tweet_id in tweet_ids:
+                continue
+            tweet_ids.add(newsfeed.tweet_id)
+            merged.append(newsfeed)
+        return merged
 
     @classmethod
     def push_newsfeed_to_cache(cls, newsfeed):
         queryset = NewsFeed.objects.filter(user_id=newsfeed.user_id).order_by('-created_at')
         key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
-        RedisHelper.push_object(key, newsfeed, queryset)
+        RedisHelper.push_object(key, newsfeed, queryset, CACHED_NEWSFEED_FIELDS)
+
+    @classmethod
+    def push_newsfeeds_to_cache(cls, newsfeeds):
+        """
+        push newsfeeds to the cache of active users only. newsfeeds of users
+        whose cache is cold are loaded when they read, and the cache of
+        inactive users is dropped so it is rebuilt instead of going stale
+        """
+        active_user_ids = UserService.get_active_user_ids(
+            newsfeed.user_id for newsfeed in newsfeeds
+        )
+        active_newsfeeds, inactive_keys = [], []
+        for newsfeed in newsfeeds:
+            key = USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+            if newsfeed.user_id in active_user_ids:
+                active_newsfeeds.append(newsfeed)
+            else:
+                inactive_keys.append(key)
+
+        if inactive_keys:
+            RedisClient.get_connection().delete(*inactive_keys)
+        keys = [
+            USER_NEWSFEEDS_PATTERN.format(user_id=newsfeed.user_id)
+            for newsfeed in active_newsfeeds
+        ]
+        return RedisHelper.push_objects(keys, active_newsfeeds, CACHED_NEWSFEED_FIELDS)
+
+    @classmethod
+    def is_fanout_batch_done(cls, tweet_id, batch_index):
+        key = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        return RedisClient.get_connection().sismember(key, batch_index)
+
+    @classmethod
+    def mark_fanout_batch_done(cls, tweet_id, batch_index):
+        key = FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet_id)
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline()
+        pipeline.sadd(key, batch_index)
+        pipeline.expire(key, ONE_DAY)
+        pipeline.execute()
+
+    @classmethod
+    def get_fanout_checkpoint(cls, tweet_id):
+        key = FANOUT_CHECKPOINT_PATTERN.format(tweet_id=tweet_id)
+        checkpoint = RedisClient.get_connection().get(key)
+        if checkpoint is None:
+            return None
+        return json.loads(checkpoint)
+
+    @classmethod
+    def save_fanout_checkpoint(cls, tweet_id, checkpoint):
+        # kept after the fanout ends, so a redelivered main task
+        # doesn't dispatch the batches again
+        key = FANOUT_CHECKPOINT_PATTERN.format(tweet_id=tweet_id)
+        RedisClient.get_connection().set(key, json.dumps(checkpoint), ex=ONE_DAY)
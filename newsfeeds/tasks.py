@@ -1,38 +1,92 @@
 from celery import shared_task
+from django.db import DatabaseError
 from friendships.services import FriendshipService
 from newsfeeds.models import NewsFeed
+from redis.exceptions import RedisError
 from tweets.models import Tweet
 from utils.time_constants import ONE_HOUR
 from newsfeeds.constants import FANOUT_BATCH_SIZE
 
+# fanout tasks are idempotent, so they are acked after they finish and
+# retried when the database or redis fails
+FANOUT_TASK_OPTIONS = {
+    'time_limit': ONE_HOUR,
+    'acks_late': True,
+    'autoretry_for': (DatabaseError, RedisError),
+    'retry_backoff': True,
+    'max_retries': 5,
+}
 
-@shared_task(routing_key='newsfeeds', time_limit=ONE_HOUR)
-def fanout_newsfeeds_batch_task(tweet_id, follower_ids):
+
+@shared_task(routing_key='newsfeeds', **FANOUT_TASK_OPTIONS)
+def fanout_newsfeeds_batch_task(tweet_id, follower_ids, batch_index=None, backfill=False):
     from newsfeeds.services import NewsFeedService
 
-    newsfeeds = [
-        NewsFeed(user_id=follower_id, tweet_id=tweet_id)
-        for follower_id in follower_ids
-    ]
-    NewsFeed.objects.bulk_create(newsfeeds)
-    for newsfeed in newsfeeds:
-        NewsFeedService.push_newsfeed_to_cache(newsfeed)
+    # batches queued before they were numbered have no progress to check
+    if batch_index is not None and NewsFeedService.is_fanout_batch_done(tweet_id, batch_index):
+        return "batch {} already done".format(batch_index)
+
+    # rows left by an interrupted run are skipped instead of failing the batch
+    NewsFeed.objects.bulk_create(
+        [
+            NewsFeed(user_id=follower_id, tweet_id=tweet_id)
+            for follower_id in follower_ids
+        ],
+        ignore_conflicts=True,
+    )
+    if backfill:
+        # old tweets keep their place in the timelines instead of showing up
+        # as new, created_at is auto_now_add so it is changed afterwards
+        tweet_created_at = Tweet.objects.filter(id=tweet_id)\
+            .values_list('created_at', flat=True).first()
+        NewsFeed.objects.filter(tweet_id=tweet_id, user_id__in=follower_ids)\
+            .update(created_at=tweet_created_at)
+    # ids aren't set by bulk_create with ignore_conflicts, read the rows back
+    newsfeeds = list(
+        NewsFeed.objects.filter(tweet_id=tweet_id, user_id__in=follower_ids)
+    )
+    NewsFeedService.push_newsfeeds_to_cache(newsfeeds)
+    if batch_index is not None:
+        NewsFeedService.mark_fanout_batch_done(tweet_id, batch_index)
 
     return "{} newsfeeds created".format(len(newsfeeds))
 
 
-@shared_task(routing_key='default', time_limit=ONE_HOUR)
-def fanout_newsfeeds_main_task(tweet_id, tweet_user_id):
-    NewsFeed.objects.create(user_id=tweet_user_id, tweet_id=tweet_id)
+@shared_task(routing_key='default', **FANOUT_TASK_OPTIONS)
+def fanout_newsfeeds_main_task(tweet_id, tweet_user_id, backfill=False):
+    from newsfeeds.services import NewsFeedService
+
+    NewsFeed.objects.get_or_create(user_id=tweet_user_id, tweet_id=tweet_id)
 
-    follower_ids = FriendshipService.get_follower_ids(tweet_user_id)
-    index = 0
-    while index < len(follower_ids):
-        batch_ids = follower_ids[index: index + FANOUT_BATCH_SIZE]
-        fanout_newsfeeds_batch_task.delay(tweet_id, batch_ids)
-        index += FANOUT_BATCH_SIZE
+    # followers of celebrities pull their tweets when reading newsfeeds
+    if NewsFeedService.is_celebrity(tweet_user_id):
+        NewsFeedService.add_celebrity(tweet_user_id, tweet_id)
+        return 'celebrity {} skipped fanout.'.format(tweet_user_id)
+    # no-op unless the author just stopped being a celebrity
+    NewsFeedService.remove_celebrity(tweet_user_id, exclude_tweet_id=tweet_id)
+
+    # followers are streamed and every batch is dispatched once it is
+    # read, a crashed task resumes from the checkpoint of the last batch
+    checkpoint = NewsFeedService.get_fanout_checkpoint(tweet_id) or {
+        'cursor': None,
+        'batches': 0,
+        'followers': 0,
+    }
+    batches = FriendshipService.iter_follower_id_batches(
+        tweet_user_id,
+        FANOUT_BATCH_SIZE,
+        checkpoint['cursor'],
+    )
+    for follower_ids, cursor in batches:
+        fanout_newsfeeds_batch_task.delay(tweet_id, follower_ids, checkpoint['batches'], backfill)
+        checkpoint = {
+            'cursor': cursor,
+            'batches': checkpoint['batches'] + 1,
+            'followers': checkpoint['followers'] + len(follower_ids),
+        }
+        NewsFeedService.save_fanout_checkpoint(tweet_id, checkpoint)
 
     return '{} newsfeeds are going to fanout, {} batches created.'.format(
-        len(follower_ids),
-        (len(follower_ids) - 1) // FANOUT_BATCH_SIZE + 1,
+        checkpoint['followers'],
+        checkpoint['batches'],
     )
@@ -1,9 +1,15 @@
+from accounts.services import UserService
+from friendships.services import FriendshipService
+from gatekeeper.models import GateKeeper
+from newsfeeds.constants import HYBRID_FANOUT_GK
 from newsfeeds.models import NewsFeed
 from newsfeeds.services import NewsFeedService
-from newsfeeds.tasks import fanout_newsfeeds_main_task
+from newsfeeds.tasks import fanout_newsfeeds_main_task, fanout_newsfeeds_batch_task
+from rest_framework.test import APIClient
 from testing_utils.testcases import TestCase
-from twitter.cache import USER_NEWSFEEDS_PATTERN
+from twitter.cache import USER_NEWSFEEDS_PATTERN, FANOUT_PROGRESS_PATTERN
 from utils.redis_client import RedisClient
+from utils.time_helpers import datetime_to_timestamp
 
 
 class NewsFeedServiceTests(TestCase):
@@ -22,21 +28,21 @@ class NewsFeedServiceTests(TestCase):
         newsfeed_ids = newsfeed_ids[::-1]
 
         # cache miss
-        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.ray.id)
+        newsfeeds = NewsFeedService.load_timeline(self.ray.id)
         self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
 
         # cache hit
-        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.ray.id)
+        newsfeeds = NewsFeedService.load_timeline(self.ray.id)
         self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
 
         # cache updated
         tweet = self.create_tweet(self.ray)
         new_newsfeed = self.create_newsfeed(self.ray, tweet)
-        newsfeeds = NewsFeedService.get_cached_newsfeeds(self.ray.id)
+        newsfeeds = NewsFeedService.load_timeline(self.ray.id)
         newsfeed_ids.insert(0, new_newsfeed.id)
         self.assertEqual([f.id for f in newsfeeds], newsfeed_ids)
 
-    def test_create_new_newsfeed_before_get_cached_newsfeeds(self):
+    def test_create_new_newsfeed_before_load_timeline(self):
         feed1 = self.create_newsfeed(self.ray, self.create_tweet(self.ray))
 
         RedisClient.clear()
@@ -47,7 +53,7 @@ class NewsFeedServiceTests(TestCase):
         feed2 = self.create_newsfeed(self.ray, self.create_tweet(self.ray))
         self.assertEqual(conn.exists(key), True)
 
-        feeds = NewsFeedService.get_cached_newsfeeds(self.ray.id)
+        feeds = NewsFeedService.load_timeline(self.ray.id)
         self.assertEqual([f.id for f in feeds], [feed2.id, feed1.id])
 
 
@@ -64,7 +70,7 @@ class NewsFeedTaskTests(TestCase):
         msg = fanout_newsfeeds_main_task(tweet.id, self.ray.id)
         self.assertEqual(msg, '1 newsfeeds are going to fanout, 1 batches created.')
         self.assertEqual(1 + 1, NewsFeed.objects.count())
-        cached_list = NewsFeedService.get_cached_newsfeeds(self.ray.id)
+        cached_list = NewsFeedService.load_timeline(self.ray.id)
         self.assertEqual(len(cached_list), 1)
 
         for i in range(2):
@@ -74,7 +80,7 @@ class NewsFeedTaskTests(TestCase):
         msg = fanout_newsfeeds_main_task(tweet.id, self.ray.id)
         self.assertEqual(msg, '3 newsfeeds are going to fanout, 1 batches created.')
         self.assertEqual(4 + 2, NewsFeed.objects.count())
-        cached_list = NewsFeedService.get_cached_newsfeeds(self.ray.id)
+        cached_list = NewsFeedService.load_timeline(self.ray.id)
         self.assertEqual(len(cached_list), 2)
 
         user = self.create_user('another user')
@@ -83,7 +89,148 @@ class NewsFeedTaskTests(TestCase):
         msg = fanout_newsfeeds_main_task(tweet.id, self.ray.id)
         self.assertEqual(msg, '4 newsfeeds are going to fanout, 2 batches created.')
         self.assertEqual(8 + 3, NewsFeed.objects.count())
-        cached_list = NewsFeedService.get_cached_newsfeeds(self.ray.id)
+        cached_list = NewsFeedService.load_timeline(self.ray.id)
         self.assertEqual(len(cached_list), 3)
-        cached_list = NewsFeedService.get_cached_newsfeeds(self.lux.id)
+        cached_list = NewsFeedService.load_timeline(self.lux.id)
         self.assertEqual(len(cached_list), 3)
+
+    def test_hybrid_fanout(self):
+        GateKeeper.set_kv(HYBRID_FANOUT_GK, 'percent', 100)
+        GateKeeper.set_kv(HYBRID_FANOUT_GK, 'threshold', 2)
+        self.create_friendship(self.lux, self.ray)
+        old_tweet = self.create_tweet(self.ray, 'before ray is a celebrity')
+        fanout_newsfeeds_main_task(old_tweet.id, self.ray.id)
+        lux_tweet = self.create_tweet(self.lux, 'lux tweet')
+        fanout_newsfeeds_main_task(lux_tweet.id, self.lux.id)
+
+        # followers don't get newsfeeds of celebrities
+        self.create_friendship(self.create_user('user'), self.ray)
+        tweet = self.create_tweet(self.ray, 'ray is a celebrity')
+        msg = fanout_newsfeeds_main_task(tweet.id, self.ray.id)
+        self.assertEqual(msg, 'celebrity {} skipped fanout.'.format(self.ray.id))
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 1)
+
+        # but pull their tweets when reading, without duplicates
+        newsfeeds = NewsFeedService.load_timeline(self.lux.id)
+        self.assertEqual(
+            [feed.tweet_id for feed in newsfeeds],
+            [tweet.id, lux_tweet.id, old_tweet.id],
+        )
+        newsfeeds = NewsFeedService.load_timeline(self.ray.id)
+        self.assertEqual([feed.tweet_id for feed in newsfeeds], [tweet.id, old_tweet.id])
+        # a window of the merged newsfeeds
+        timestamp = datetime_to_timestamp(tweet.created_at)
+        newsfeeds = NewsFeedService.load_timeline(self.lux.id, max_timestamp=timestamp, limit=1)
+        self.assertEqual([feed.tweet_id for feed in newsfeeds], [lux_tweet.id])
+        newsfeeds = NewsFeedService.load_timeline(self.lux.id, limit=2)
+        self.assertEqual([feed.tweet_id for feed in newsfeeds], [tweet.id, lux_tweet.id])
+
+        # pulled tweets have no newsfeed id
+        client = APIClient()
+        client.force_authenticate(self.lux)
+        results = client.get('/api/newsfeeds/').data['results']
+        self.assertEqual(results[0]['id'], None)
+        self.assertEqual(results[0]['tweet']['id'], tweet.id)
+
+        later_lux_tweet = self.create_tweet(self.lux, 'lux tweet after ray is a celebrity')
+        fanout_newsfeeds_main_task(later_lux_tweet.id, self.lux.id)
+        # once ray drops below the threshold, the tweets that skipped fanout
+        # are pushed at the time they were posted and followers stop pulling
+        GateKeeper.set_kv(HYBRID_FANOUT_GK, 'threshold', 10)
+        new_tweet = self.create_tweet(self.ray, 'ray is no celebrity anymore')
+        fanout_newsfeeds_main_task(new_tweet.id, self.ray.id)
+        self.assertEqual(NewsFeedService.get_followed_celebrity_ids(self.lux.id), set())
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 3)
+        self.assertEqual(NewsFeed.objects.filter(tweet=new_tweet).count(), 3)
+        newsfeeds = NewsFeedService.load_timeline(self.lux.id)
+        self.assertEqual(
+            [feed.tweet_id for feed in newsfeeds],
+            [new_tweet.id, later_lux_tweet.id, tweet.id, lux_tweet.id, old_tweet.id],
+        )
+        self.assertEqual(all(feed.id is not None for feed in newsfeeds), True)
+        feed = NewsFeed.objects.get(user=self.lux, tweet=tweet)
+        self.assertEqual(feed.created_at, tweet.created_at)
+
+    def test_fanout_batch_task(self):
+        # only newsfeeds which are cached are pushed to
+        feed = self.create_newsfeed(self.ray, self.create_tweet(self.ray))
+        tweet = self.create_tweet(self.lux)
+        UserService.mark_active(self.ray.id)
+        UserService.mark_active(self.lux.id)
+        msg = fanout_newsfeeds_batch_task(tweet.id, [self.ray.id, self.lux.id], 0)
+        self.assertEqual(msg, '2 newsfeeds created')
+        conn = RedisClient.get_connection()
+        ray_key = USER_NEWSFEEDS_PATTERN.format(user_id=self.ray.id)
+        lux_key = USER_NEWSFEEDS_PATTERN.format(user_id=self.lux.id)
+        self.assertEqual(conn.zcard(ray_key), 2)
+        self.assertEqual(conn.exists(lux_key), False)
+
+        newsfeeds = NewsFeedService.load_timeline(self.ray.id)
+        self.assertEqual([f.tweet_id for f in newsfeeds], [tweet.id, feed.tweet_id])
+        newsfeeds = NewsFeedService.load_timeline(self.lux.id)
+        self.assertEqual([f.tweet_id for f in newsfeeds], [tweet.id])
+
+        # cache of inactive users is dropped instead of pushed to
+        dormant = self.create_user('dormant')
+        self.create_newsfeed(dormant, self.create_tweet(dormant))
+        dormant_key = USER_NEWSFEEDS_PATTERN.format(user_id=dormant.id)
+        self.assertEqual(conn.exists(dormant_key), True)
+        tweet = self.create_tweet(self.lux)
+        fanout_newsfeeds_batch_task(tweet.id, [dormant.id], 0)
+        self.assertEqual(conn.exists(dormant_key), False)
+        newsfeeds = NewsFeedService.load_timeline(dormant.id)
+        self.assertEqual(newsfeeds[0].tweet_id, tweet.id)
+
+    def test_fanout_is_idempotent(self):
+        UserService.mark_active(self.lux.id)
+        self.create_friendship(self.lux, self.ray)
+        NewsFeedService.load_timeline(self.lux.id)
+        self.create_newsfeed(self.lux, self.create_tweet(self.lux))
+        tweet = self.create_tweet(self.ray)
+
+        # a redelivered batch is skipped
+        fanout_newsfeeds_main_task(tweet.id, self.ray.id)
+        msg = fanout_newsfeeds_batch_task(tweet.id, [self.lux.id], 0)
+        self.assertEqual(msg, 'batch 0 already done')
+
+        # a batch interrupted after the rows were written can be run again
+        RedisClient.get_connection().delete(
+            FANOUT_PROGRESS_PATTERN.format(tweet_id=tweet.id),
+        )
+        msg = fanout_newsfeeds_batch_task(tweet.id, [self.lux.id], 0)
+        self.assertEqual(msg, '1 newsfeeds created')
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 2)
+        newsfeeds = NewsFeedService.load_timeline(self.lux.id)
+        self.assertEqual(len(newsfeeds), 2)
+        self.assertEqual(newsfeeds[0].tweet_id, tweet.id)
+        self.assertEqual(newsfeeds[0].id, NewsFeed.objects.get(user=self.lux, tweet=tweet).id)
+
+        # batches queued without an index still run
+        msg = fanout_newsfeeds_batch_task(tweet.id, [self.lux.id])
+        self.assertEqual(msg, '1 newsfeeds created')
+
+    def test_fanout_resumes_from_checkpoint(self):
+        followers = [self.create_user('user{}'.format(i)) for i in range(5)]
+        for follower in followers:
+            self.create_friendship(follower, self.ray)
+
+        # the first batch was dispatched before the task crashed
+        tweet = self.create_tweet(self.ray)
+        follower_ids, cursor = next(FriendshipService.iter_follower_id_batches(self.ray.id, 3))
+        self.assertEqual(follower_ids, [follower.id for follower in followers[:3]])
+        NewsFeedService.save_fanout_checkpoint(tweet.id, {
+            'cursor': cursor,
+            'batches': 1,
+            'followers': 3,
+        })
+        msg = fanout_newsfeeds_main_task(tweet.id, self.ray.id)
+        self.assertEqual(msg, '5 newsfeeds are going to fanout, 2 batches created.')
+        self.assertEqual(
+            set(NewsFeed.objects.filter(tweet=tweet).values_list('user_id', flat=True)),
+            {self.ray.id, followers[3].id, followers[4].id},
+        )
+
+        # nothing is dispatched again once the fanout is done
+        msg = fanout_newsfeeds_main_task(tweet.id, self.ray.id)
+        self.assertEqual(msg, '5 newsfeeds are going to fanout, 2 batches created.')
+        self.assertEqual(NewsFeed.objects.filter(tweet=tweet).count(), 3)
@@ -1,4 +1,5 @@
 from accounts.api.serializers import UserSerializerForTweet
+from accounts.services import UserService
 from comments.api.serializers import CommentSerializer
 from likes.api.serializers import LikeSerializer
 from likes.services import LikeService
@@ -11,7 +12,7 @@ from utils.redis_helper import RedisHelper
 
 
 class TweetSerializer(serializers.ModelSerializer):
-    user = UserSerializerForTweet(source='cached_user')
+    user = serializers.SerializerMethodField()
     comments_count = serializers.SerializerMethodField()
     likes_count = serializers.SerializerMethodField()
     has_liked = serializers.SerializerMethodField()
@@ -30,16 +31,53 @@ class TweetSerializer(serializers.ModelSerializer):
             'photo_urls',
         )
 
+    @classmethod
+    def get_page_context(cls, request, tweets):
+        # hydrate the whole page up front, one round trip per data source
+        # instead of several for every tweet
+        tweets = list(tweets)
+        tweet_ids = [tweet.id for tweet in tweets]
+        return {
+            'request': request,
+            'users': UserService.get_users_through_cache(
+                set(tweet.user_id for tweet in tweets),
+            ),
+            'likes_counts': RedisHelper.get_counts(tweets, 'likes_count'),
+            'comments_counts': RedisHelper.get_counts(tweets, 'comments_count'),
+            'liked_tweet_ids': LikeService.get_liked_object_ids(
+                request.user,
+                Tweet,
+                tweet_ids,
+            ),
+            'photo_urls': TweetService.get_photo_urls(tweet_ids),
+        }
+
+    def get_user(self, obj):
+        user = self.context.get('users', {}).get(obj.user_id)
+        if user is None:
+            user = obj.cached_user
+        return UserSerializerForTweet(user).data
+
     def get_likes_count(self, obj):
+        counts = self.context.get('likes_counts', {})
+        if obj.id in counts:
+            return counts[obj.id]
         return RedisHelper.get_count(obj, 'likes_count')
 
     def get_comments_count(self, obj):
+        counts = self.context.get('comments_counts', {})
+        if obj.id in counts:
+            return counts[obj.id]
         return RedisHelper.get_count(obj, 'comments_count')
 
     def get_has_liked(self, obj):
+        if 'liked_tweet_ids' in self.context:
+            return obj.id in self.context['liked_tweet_ids']
         return LikeService.has_liked(self.context['request'].user, obj)
 
     def get_photo_urls(self, obj):
+        if 'photo_urls' in self.context:
+            return self.context['photo_urls'].get(obj.id, [])
         photo_urls = []
         for photo in obj.tweetphoto_set.all().order_by('order'):
             photo_urls.append(photo.file.url)
@@ -50,6 +88,18 @@ class TweetSerializerForDetail(TweetSerializer):
     comments = CommentSerializer(source='comment_set', many=True)
     likes = LikeSerializer(source='like_set', many=True)
 
+    @classmethod
+    def get_page_context(cls, request, tweets):
+        # the authors of the comments and likes are hydrated with the tweet's
+        context = super().get_page_context(request, tweets)
+        user_ids = set()
+        for tweet in tweets:
+            user_ids.update(tweet.comment_set.values_list('user_id', flat=True))
+            user_ids.update(tweet.like_set.values_list('user_id', flat=True))
+        user_ids -= set(context['users'].keys())
+        context['users'].update(UserService.get_users_through_cache(user_ids))
+        return context
+
     class Meta:
         model = Tweet
         fields = (
@@ -208,3 +208,26 @@ class TweetApiTests(TestCase):
         self.assertEqual(response.data['has_next_page'], False)
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['id'], new_tweet.id)
+
+    def test_list_with_page_context(self):
+        self.create_like(self.user1, self.tweets2[0])
+        self.create_like(self.user2, self.tweets2[0])
+        self.create_comment(self.user1, self.tweets2[1])
+        TweetPhoto.objects.create(tweet=self.tweets2[1], user=self.user2, file='a.jpg', order=1)
+        TweetPhoto.objects.create(tweet=self.tweets2[1], user=self.user2, file='b.jpg', order=0)
+
+        response = self.user1_client.get(TWEET_LIST_API, {'user_id': self.user2.id})
+        results = response.data['results']
+        self.assertEqual(results[0]['id'], self.tweets2[1].id)
+        self.assertEqual(results[0]['user']['username'], 'user2')
+        self.assertEqual(results[0]['comments_count'], 1)
+        self.assertEqual(results[0]['has_liked'], False)
+        self.assertEqual(len(results[0]['photo_urls']), 2)
+        self.assertEqual(results[0]['photo_urls'][0].endswith('b.jpg'), True)
+        self.assertEqual(results[1]['likes_count'], 2)
+        self.assertEqual(results[1]['has_liked'], True)
+        self.assertEqual(results[1]['photo_urls'], [])
+
+        # anonymous users have liked nothing
+        response = self.anonymous_client.get(TWEET_LIST_API, {'user_id': self.user2.id})
+        self.assertEqual(response.data['results'][1]['has_liked'], False)
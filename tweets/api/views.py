@@ -30,14 +30,14 @@ class TweetViewSet(viewsets.GenericViewSet):
         user_id = request.query_params['user_id']
         tweets = Tweet.objects.filter(user_id=user_id).prefetch_related('user')
 
-        cached_tweets = TweetService.get_cached_tweets(user_id)
-        page = self.paginator.paginate_cached_list(cached_tweets, request)
-        if page is None:
-            queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
-            page = self.paginate_queryset(queryset)
+        page = self.paginator.paginate_cached_timeline(
+            lambda **kwargs: TweetService.load_timeline(user_id, **kwargs),
+            request,
+        )
+        page = TweetService.get_tweets_through_cache([tweet.id for tweet in page])
         serializer = TweetSerializer(
             page,
-            context={'request': request},
+            context=TweetSerializer.get_page_context(request, page),
             many=True,
         )
         return self.get_paginated_response(serializer.data)
@@ -47,7 +47,7 @@ class TweetViewSet(viewsets.GenericViewSet):
         tweet = self.get_object()
         serializer = TweetSerializerForDetail(
             tweet,
-            context={'request': request},
+            context=TweetSerializerForDetail.get_page_context(request, [tweet]),
         )
         return Response(serializer.data)
 
@@ -12,3 +12,9 @@ TWEET_PHOTO_STATUS_CHOICES = (
 
 
 TWEET_PHOTOS_UPLOAD_LIMIT = 9
+
+# fields of tweets kept in the cached timelines
+CACHED_TWEET_FIELDS = ('id', 'created_at')
+
+# counts changed in redis first and flushed to db by flush_tweet_counts_task
+BUFFERED_TWEET_COUNTS = ('likes_count', 'comments_count')
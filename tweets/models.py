@@ -71,6 +71,16 @@ class TweetPhoto(models.Model):
         return f'{self.tweet_id}: {self.file}'
 
 
+class TweetCountFlush(models.Model):
+    # a flush of the buffered tweet counts that is committed to db, so a
+    # flush which is retried after the commit doesn't apply it twice
+    flush_id = models.CharField(max_length=32, unique=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.created_at}: {self.flush_id}'
+
+
 post_save.connect(invalidate_object_cache, sender=Tweet)
 pre_delete.connect(invalidate_object_cache, sender=Tweet)
 post_save.connect(push_tweet_to_cache, sender=Tweet)
@@ -1,5 +1,7 @@
+from tweets.constants import CACHED_TWEET_FIELDS
 from tweets.models import Tweet, TweetPhoto
 from twitter.cache import USER_TWEETS_PATTERN
+from utils.memcached_helper import MemcachedHelper
 from utils.redis_helper import RedisHelper
 
 
@@ -19,13 +21,42 @@ class TweetService(object):
         TweetPhoto.objects.bulk_create(photos)
 
     @classmethod
-    def get_cached_tweets(cls, user_id):
+    def get_photo_urls(cls, tweet_ids):
+        """
+        photo urls of a page of tweets in one query,
+        returns a dict of tweet_id -> urls in upload order
+        """
+        photo_urls = {}
+        photos = TweetPhoto.objects.filter(tweet_id__in=tweet_ids).order_by('order')
+        for photo in photos:
+            photo_urls.setdefault(photo.tweet_id, []).append(photo.file.url)
+        return photo_urls
+
+    @classmethod
+    def load_timeline(cls, user_id, max_timestamp=None, min_timestamp=None, limit=None):
+        """
+        only id and created_at of the tweets are loaded,
+        use get_tweets_through_cache() for the page that is shown
+        """
         queryset = Tweet.objects.filter(user_id=user_id).order_by('-created_at')
         key = USER_TWEETS_PATTERN.format(user_id=user_id)
-        return RedisHelper.load_objects(key, queryset)
+        return RedisHelper.load_timeline(
+            key,
+            queryset,
+            CACHED_TWEET_FIELDS,
+            max_timestamp,
+            min_timestamp,
+            limit,
+        )
+
+    @classmethod
+    def get_tweets_through_cache(cls, tweet_ids):
+        # keep the order of tweet_ids, deleted tweets are skipped
+        tweets = MemcachedHelper.get_objects_through_cache(Tweet, tweet_ids)
+        return [tweets[tweet_id] for tweet_id in tweet_ids if tweet_id in tweets]
 
     @classmethod
     def push_tweet_to_cache(cls, tweet):
         queryset = Tweet.objects.filter(user_id=tweet.user_id).order_by('-created_at')
         key = USER_TWEETS_PATTERN.format(user_id=tweet.user_id)
-        RedisHelper.push_object(key, tweet, queryset)
+        RedisHelper.push_object(key, tweet, queryset, CACHED_TWEET_FIELDS)
@@ -0,0 +1,13 @@
+from celery import shared_task
+from django.conf import settings
+from tweets.constants import BUFFERED_TWEET_COUNTS
+from tweets.models import Tweet, TweetCountFlush
+from utils.redis_helper import RedisHelper
+
+
+@shared_task(routing_key='default', time_limit=settings.REDIS_FLUSH_LOCK_TIMEOUT)
+def flush_tweet_counts_task():
+    flushed = 0
+    for attr in BUFFERED_TWEET_COUNTS:
+        flushed += RedisHelper.flush_buffered_counts(Tweet, attr, TweetCountFlush)
+    return '{} tweet counts flushed'.format(flushed)
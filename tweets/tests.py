@@ -1,10 +1,11 @@
+from django.conf import settings
 from datetime import timedelta
 from testing_utils.testcases import TestCase
 from tweets.constants import TweetPhotoStatus
 from tweets.models import TweetPhoto
 from utils.redis_client import RedisClient
 from utils.redis_serializers import DjangoModelSerializer
-from utils.time_helpers import utc_now
+from utils.time_helpers import utc_now, datetime_to_timestamp
 from twitter.cache import USER_TWEETS_PATTERN
 from tweets.services import TweetService
 
@@ -71,20 +72,60 @@ class TweetServiceTests(TestCase):
         conn = RedisClient.get_connection()
 
         # cache miss
-        tweets = TweetService.get_cached_tweets(self.ray.id)
+        tweets = TweetService.load_timeline(self.ray.id)
         self.assertEqual([t.id for t in tweets], tweet_ids)
 
         # cache hit
-        tweets = TweetService.get_cached_tweets(self.ray.id)
+        tweets = TweetService.load_timeline(self.ray.id)
         self.assertEqual([t.id for t in tweets], tweet_ids)
 
         # cache updated
         new_tweet = self.create_tweet(self.ray, 'new tweet')
-        tweets = TweetService.get_cached_tweets(self.ray.id)
+        tweets = TweetService.load_timeline(self.ray.id)
         tweet_ids.insert(0, new_tweet.id)
         self.assertEqual([t.id for t in tweets], tweet_ids)
 
-    def test_create_new_tweet_before_get_cached_tweets(self):
+    def test_cached_tweets_only_keep_ids(self):
+        tweet1 = self.create_tweet(self.ray, 'tweet1')
+        tweet2 = self.create_tweet(self.ray, 'tweet2')
+        conn = RedisClient.get_connection()
+        key = USER_TWEETS_PATTERN.format(user_id=self.ray.id)
+        timestamp1 = datetime_to_timestamp(tweet1.created_at)
+        timestamp2 = datetime_to_timestamp(tweet2.created_at)
+        self.assertEqual(conn.zrevrange(key, 0, -1, withscores=True), [
+            ('{}:{}'.format(tweet2.id, timestamp2).encode('utf-8'), timestamp2),
+            ('{}:{}'.format(tweet1.id, timestamp1).encode('utf-8'), timestamp1),
+        ])
+        tweets = TweetService.load_timeline(self.ray.id)
+        self.assertEqual([t.created_at for t in tweets], [tweet2.created_at, tweet1.created_at])
+
+        # edits show up without touching the cached list
+        tweet1.content = 'edited'
+        tweet1.save()
+        tweets = TweetService.get_tweets_through_cache([t.id for t in tweets])
+        self.assertEqual([t.content for t in tweets], ['tweet2', 'edited'])
+
+        # deleted tweets are skipped
+        tweet2.delete()
+        tweets = TweetService.get_tweets_through_cache([tweet2.id, tweet1.id])
+        self.assertEqual([t.id for t in tweets], [tweet1.id])
+
+    def test_load_window_of_cached_tweets(self):
+        list_limit = settings.REDIS_LIST_LENGTH_LIMIT
+        tweets = [self.create_tweet(self.ray) for _ in range(list_limit + 5)][::-1]
+        tweet_ids = [tweet.id for tweet in tweets]
+
+        timestamp = datetime_to_timestamp(tweets[2].created_at)
+        cached_tweets = TweetService.load_timeline(self.ray.id, max_timestamp=timestamp, limit=5)
+        self.assertEqual([t.id for t in cached_tweets], tweet_ids[3:8])
+        # running past the tail of the cache reads from db
+        timestamp = datetime_to_timestamp(tweets[list_limit - 3].created_at)
+        cached_tweets = TweetService.load_timeline(self.ray.id, max_timestamp=timestamp, limit=4)
+        self.assertEqual([t.id for t in cached_tweets], tweet_ids[list_limit - 2:list_limit + 2])
+        cached_tweets = TweetService.load_timeline(self.ray.id, min_timestamp=timestamp)
+        self.assertEqual([t.id for t in cached_tweets], tweet_ids[:list_limit - 3])
+
+    def test_create_new_tweet_before_load_timeline(self):
         tweet1 = self.create_tweet(self.ray, 'tweet1')
 
         RedisClient.clear()
@@ -95,5 +136,5 @@ class TweetServiceTests(TestCase):
         tweet2 = self.create_tweet(self.ray, 'tweet2')
         self.assertEqual(conn.exists(key), True)
 
-        tweets = TweetService.get_cached_tweets(self.ray.id)
+        tweets = TweetService.load_timeline(self.ray.id)
         self.assertEqual([t.id for t in tweets], [tweet2.id, tweet1.id])
@@ -1,7 +1,20 @@
 # memcached
-FOLLOWINGS_PATTERN = 'followings:{user_id}'
 USER_PROFILE_PATTERN = 'userprofile:{user_id}'
 
 # redis
-USER_TWEETS_PATTERN = 'user_tweets:{user_id}'
-USER_NEWSFEEDS_PATTERN = 'user_newsfeeds:{user_id}'
+# sorted sets of ids scored by timestamps, objects are read from memcached
+USER_TWEETS_PATTERN = 'user_tweet_timeline:{user_id}'
+USER_NEWSFEEDS_PATTERN = 'user_newsfeed_timeline:{user_id}'
+USER_FOLLOWINGS_PATTERN = 'user_followings:{user_id}'
+CELEBRITY_USER_IDS_KEY = 'celebrity_user_ids'
+# user_id -> id of the first tweet that skipped fanout
+CELEBRITY_SINCE_TWEET_IDS_KEY = 'celebrity_since_tweet_ids'
+ACTIVE_USERS_KEY = 'active_users'
+FANOUT_PROGRESS_PATTERN = 'fanout_progress:{tweet_id}'
+FANOUT_CHECKPOINT_PATTERN = 'fanout_checkpoint:{tweet_id}'
+# pub/sub channel of keys to drop from the local cache of every process
+LOCAL_CACHE_INVALIDATION_CHANNEL = 'local_cache_invalidation'
+
+# local cache
+# users this process marked as active recently
+ACTIVE_USER_MARKED_PATTERN = 'active_user_marked:{user_id}'
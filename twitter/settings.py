@@ -79,6 +79,8 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
+    'accounts.middleware.ActiveUserMiddleware',
+    'gatekeeper.middleware.GateKeeperMiddleware',
 ]
 
 ROOT_URLCONF = 'twitter.urls'
@@ -192,6 +194,19 @@ CACHES = {
     },
 }
 
+# cached values are refreshed early by chance before they expire, the
+# larger the beta the earlier. they are kept MEMCACHED_STALE_TIME longer
+# than the timeout to be served while one request refreshes them
+MEMCACHED_XFETCH_BETA = 1.0
+MEMCACHED_STALE_TIME = 60  # in seconds
+# how long to wait for another thread loading the same key
+MEMCACHED_LOAD_WAIT_TIME = 3  # in seconds
+# hot values are also kept in the memory of each process, changes are
+# broadcast over redis pub/sub and the ttl bounds how stale a missed one gets
+LOCAL_CACHE_MAX_SIZE = 10000
+LOCAL_CACHE_TTL = 10  # in seconds
+GATEKEEPER_CACHE_TTL = 5  # in seconds
+
 # Redis
 # Install Method: sudo apt-get install redis
 # Then install python client for redis： pip install redis
@@ -200,6 +215,14 @@ REDIS_PORT = 6379
 REDIS_DB = 0 if TESTING else 1
 REDIS_KEY_EXPIRE_TIME = 7 * 86400  # in seconds
 REDIS_LIST_LENGTH_LIMIT = 1000 if not TESTING else 20
+# only one process fills a missing timeline, the others wait at most this long
+REDIS_FILL_LOCK_TIMEOUT = 3000  # in milliseconds
+# only one worker flushes the buffered counts of a model at a time
+REDIS_FLUSH_LOCK_TIMEOUT = 300  # in seconds
+# users who made a request within this time get newsfeeds pushed to cache
+ACTIVE_USER_WINDOW = 3 * 86400  # in seconds
+# a process marks the same user as active at most once in this time
+ACTIVE_USER_MARK_INTERVAL = 3600  # in seconds
 
 # Celery Configuration Options
 # celery -A twitter worker -l INFO
@@ -210,6 +233,25 @@ CELERY_QUEUES = (
     Queue('default', routing_key='default'),
     Queue('newsfeeds', routing_key='newsfeeds'),
 )
+# celery -A twitter beat -l INFO
+CELERY_BEAT_SCHEDULE = {
+    'reconcile-friendship-counts': {
+        'task': 'friendships.tasks.reconcile_friendship_counts_task',
+        'schedule': 86400,  # in seconds
+    },
+    'flush-tweet-counts': {
+        'task': 'tweets.tasks.flush_tweet_counts_task',
+        'schedule': 10,  # in seconds
+    },
+    'flush-friendship-counts': {
+        'task': 'friendships.tasks.flush_friendship_counts_task',
+        'schedule': 10,  # in seconds
+    },
+    'trim-active-users': {
+        'task': 'accounts.tasks.trim_active_users_task',
+        'schedule': 3600,  # in seconds
+    },
+}
 
 # Rate Limiter
 RATELIMIT_USE_CACHE = 'ratelimit'
@@ -218,6 +260,12 @@ RATELIMIT_ENABLE = not TESTING  # close ratelimit when testing
 
 # HBase Database
 HBASE_HOST = '127.0.0.1'
+HBASE_POOL_SIZE = 10
+HBASE_POOL_TIMEOUT = 3  # in seconds, how long to wait for a free connection
+HBASE_READ_RETRIES = 3
+HBASE_RETRY_BACKOFF = 0.05  # in seconds, doubled on every retry
+HBASE_BATCH_SIZE = 1000  # mutations sent per batch request
+HBASE_SCAN_BATCH_SIZE = 1000  # rows fetched per scanner round trip
 
 try:
     from .local_settings import *
@@ -0,0 +1,98 @@
+from collections import OrderedDict
+from django.conf import settings
+from twitter.cache import LOCAL_CACHE_INVALIDATION_CHANNEL
+from utils.redis_client import RedisClient
+
+import os
+import pickle
+import threading
+import time
+
+
+class LocalCache:
+    """
+    a bounded lru cache in the memory of the process, entries expire after
+    ttl seconds. values are pickled like in memcached, every get returns a
+    new copy, so the threads of the process never share an object
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # pid of the process the subscriber runs in, threads do not survive a fork
+        self.subscriber_pid = None
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        return pickle.loads(value)
+
+    def set(self, key, value, ttl=None):
+        self._start_subscriber()
+        if ttl is None:
+            ttl = self.ttl
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.entries[key] = (value, time.time() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def invalidate(self, key):
+        # drop the key here and in every other process
+        self.delete(key)
+        conn = RedisClient.get_connection()
+        conn.publish(LOCAL_CACHE_INVALIDATION_CHANNEL, key)
+
+    def _start_subscriber(self):
+        pid = os.getpid()
+        if self.subscriber_pid == pid:
+            return
+        with self.lock:
+            if self.subscriber_pid == pid:
+                return
+            self.subscriber_pid = pid
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def _listen(self):
+        reconnecting = False
+        try:
+            while True:
+                try:
+                    pubsub = RedisClient.get_connection().pubsub(ignore_subscribe_messages=True)
+                    pubsub.subscribe(LOCAL_CACHE_INVALIDATION_CHANNEL)
+                    if reconnecting:
+                        # invalidations sent while not subscribed are lost
+                        self.clear()
+                    reconnecting = True
+                    for message in pubsub.listen():
+                        self.delete(message['data'].decode('utf-8'))
+                except Exception:
+                    # whatever broke the subscription, values must not
+                    # outlive their invalidation, so keep listening
+                    reconnecting = True
+                    time.sleep(1)
+        finally:
+            # the next set() starts a new subscriber if this one ever exits
+            self.subscriber_pid = None
+            self.clear()
+
+
+local_cache = LocalCache(settings.LOCAL_CACHE_MAX_SIZE, settings.LOCAL_CACHE_TTL)
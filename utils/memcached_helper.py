@@ -1,30 +1,190 @@
+from collections import namedtuple
 from django.conf import settings
 from django.core.cache import caches
+from utils.local_cache import local_cache
+
+import copy
+import math
+import random
+import threading
+import time
 
 cache = caches['testing'] if settings.TESTING else caches['default']
 
+# value is stored with how long it took to load (delta) and when it expires
+# logically, memcached keeps it MEMCACHED_STALE_TIME longer to serve it stale
+CachedValue = namedtuple('CachedValue', ['value', 'delta', 'expires_at'])
+
+
+class Flight:
+    """
+    a load of a key in progress, other threads of the process wait for it
+    """
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.loaded = False
+        self.value = None
+
 
 class MemcachedHelper:
+    # key -> Flight, loads in progress in this process
+    flights = {}
+    lock = threading.Lock()
 
     @classmethod
     def get_key(cls, model_class, object_id):
         return '{}:{}'.format(model_class.__name__, object_id)
 
+    @classmethod
+    def set_value(cls, key, value, delta):
+        cache.set(key, cls._wrap(value, delta), cls._get_memcached_timeout())
+
+    @classmethod
+    def _get_memcached_timeout(cls):
+        return cache.default_timeout + settings.MEMCACHED_STALE_TIME
+
+    @classmethod
+    def _wrap(cls, value, delta):
+        return CachedValue(value, delta, time.time() + cache.default_timeout)
+
+    @classmethod
+    def _should_refresh(cls, entry, now):
+        """
+        XFetch, refresh before expiring with a probability growing as the
+        expiry gets closer and the value is slower to load, so popular keys
+        are refreshed by one request instead of expiring for all of them
+        """
+        if not isinstance(entry, CachedValue):
+            # written before values were wrapped, wait for it to expire
+            return False
+        gap = -entry.delta * settings.MEMCACHED_XFETCH_BETA * math.log(1 - random.random())
+        return now + gap >= entry.expires_at
+
+    @classmethod
+    def _unwrap(cls, entry):
+        if isinstance(entry, CachedValue):
+            return entry.value
+        return entry
+
+    @classmethod
+    def get_through_cache(cls, key, load_value):
+        """
+        get a value from cache, load_value() loads it on a miss. a value
+        about to expire is refreshed early, and while it is refreshed other
+        threads of this process get the cached one
+        """
+        value = local_cache.get(key)
+        if value is not None:
+            return value
+        entry = cache.get(key)
+        if entry is not None and not cls._should_refresh(entry, time.time()):
+            value = cls._unwrap(entry)
+        else:
+            value = cls._load_once(key, load_value, entry)
+        local_cache.set(key, value)
+        return value
+
+    @classmethod
+    def _load_once(cls, key, load_value, entry):
+        # single flight, only one thread of the process loads a key at a time
+        with cls.lock:
+            flight = cls.flights.get(key)
+            is_loading = flight is None
+            if is_loading:
+                flight = cls.flights[key] = Flight()
+
+        if not is_loading:
+            # stale while revalidate
+            if entry is not None:
+                return cls._unwrap(entry)
+            flight.event.wait(settings.MEMCACHED_LOAD_WAIT_TIME)
+            if flight.loaded:
+                # the loading thread has the value, each waiter gets a copy
+                return copy.deepcopy(flight.value)
+            # the other load failed or is too slow
+            return load_value()
+
+        try:
+            start = time.time()
+            value = load_value()
+            cls.set_value(key, value, time.time() - start)
+            flight.value, flight.loaded = value, True
+            return value
+        finally:
+            with cls.lock:
+                del cls.flights[key]
+            flight.event.set()
+
+    @classmethod
+    def get_many_through_cache(cls, keys, load_values):
+        """
+        batch version of get_through_cache, one get_many and one
+        load_values(ids) for the missing ids. keys is a dict of key -> id,
+        load_values returns a dict of id -> value and the ids it skips are
+        missing in the result
+        """
+        values, remote_keys = {}, {}
+        for key, object_id in keys.items():
+            value = local_cache.get(key)
+            if value is None:
+                remote_keys[key] = object_id
+            else:
+                values[object_id] = value
+        if not remote_keys:
+            return values
+
+        cached = cache.get_many(remote_keys.keys())
+        now = time.time()
+        missing_ids = []
+        for key, object_id in remote_keys.items():
+            entry = cached.get(key)
+            if entry is None or cls._should_refresh(entry, now):
+                missing_ids.append(object_id)
+            else:
+                values[object_id] = cls._unwrap(entry)
+                local_cache.set(key, values[object_id])
+        if not missing_ids:
+            return values
+
+        start = time.time()
+        loaded_values = load_values(missing_ids)
+        delta = time.time() - start
+        key_by_id = {object_id: key for key, object_id in keys.items()}
+        cache.set_many(
+            {
+                key_by_id[object_id]: cls._wrap(value, delta)
+                for object_id, value in loaded_values.items()
+            },
+            cls._get_memcached_timeout(),
+        )
+        for object_id, value in loaded_values.items():
+            local_cache.set(key_by_id[object_id], value)
+        values.update(loaded_values)
+        return values
+
     @classmethod
     def get_object_through_cache(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
-        # cache hit
-        obj = cache.get(key)
-        if obj:
-            return obj
+        return cls.get_through_cache(
+            key,
+            lambda: model_class.objects.get(id=object_id),
+        )
 
-        # cache miss
-        obj = model_class.objects.get(id=object_id)
-        # using default expire time
-        cache.set(key, obj)
-        return obj
+    @classmethod
+    def get_objects_through_cache(cls, model_class, object_ids):
+        """
+        batch version of get_object_through_cache, one get_many and at most
+        one db query. returns a dict of id -> object, missing ids are skipped
+        """
+        keys = {cls.get_key(model_class, object_id): object_id for object_id in object_ids}
+        return cls.get_many_through_cache(
+            keys,
+            lambda ids: {obj.id: obj for obj in model_class.objects.filter(id__in=ids)},
+        )
 
     @classmethod
     def invalidate_cached_object(cls, model_class, object_id):
         key = cls.get_key(model_class, object_id)
         cache.delete(key)
+        local_cache.invalidate(key)
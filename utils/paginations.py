@@ -1,8 +1,8 @@
 from dateutil import parser
-from django.conf import settings
 from rest_framework.pagination import BasePagination
 from rest_framework.response import Response
 from utils.time_constants import MAX_TIMESTAMP
+from utils.time_helpers import datetime_to_timestamp
 
 
 class EndlessPagination(BasePagination):
@@ -15,30 +15,6 @@ class EndlessPagination(BasePagination):
     def to_html(self):
         pass
 
-    def paginate_ordered_list(self, reverse_ordered_list, request):
-        if 'created_at__gt' in request.query_params:
-            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
-            objects = []
-            for obj in reverse_ordered_list:
-                if obj.created_at > created_at__gt:
-                    objects.append(obj)
-                else:
-                    break
-            self.has_next_page = False
-            return objects
-
-        index = 0
-        if 'created_at__lt' in request.query_params:
-            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
-            for index, obj in enumerate(reverse_ordered_list):
-                if obj.created_at < created_at__lt:
-                    break
-            else:
-                # if qualified objects cannot be found, return empty list
-                reverse_ordered_list = []
-        self.has_next_page = len(reverse_ordered_list) > index + self.page_size
-        return reverse_ordered_list[index: index + self.page_size]
-
     def paginate_queryset(self, queryset, request, view=None):
         if 'created_at__gt' in request.query_params:
             created_at__gt = request.query_params['created_at__gt']
@@ -54,15 +30,23 @@ class EndlessPagination(BasePagination):
         self.has_next_page = len(queryset) > self.page_size
         return queryset[:self.page_size]
 
-    def paginate_cached_list(self, cached_list, request):
-        paginated_list = self.paginate_ordered_list(cached_list, request)
+    def paginate_cached_timeline(self, load_timeline, request):
+        """
+        load_timeline(max_timestamp, min_timestamp, limit) reads a window of a
+        cached timeline newest first, see RedisHelper.load_timeline
+        """
         if 'created_at__gt' in request.query_params:
-            return paginated_list
-        if self.has_next_page:
-            return paginated_list
-        if len(cached_list) < settings.REDIS_LIST_LENGTH_LIMIT:
-            return paginated_list
-        return None
+            created_at__gt = parser.isoparse(request.query_params['created_at__gt'])
+            self.has_next_page = False
+            return load_timeline(min_timestamp=datetime_to_timestamp(created_at__gt))
+
+        max_timestamp = None
+        if 'created_at__lt' in request.query_params:
+            created_at__lt = parser.isoparse(request.query_params['created_at__lt'])
+            max_timestamp = datetime_to_timestamp(created_at__lt)
+        objects = load_timeline(max_timestamp=max_timestamp, limit=self.page_size + 1)
+        self.has_next_page = len(objects) > self.page_size
+        return objects[:self.page_size]
 
     def get_paginated_response(self, data):
         return Response({
@@ -1,57 +1,361 @@
+from collections import defaultdict
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from utils.redis_client import RedisClient
-from utils.redis_serializers import DjangoModelSerializer
+from utils.redis_serializers import CompactModelSerializer
+from utils.time_helpers import datetime_to_timestamp, timestamp_to_datetime
+
+import time
+import uuid
+
+# the delta is logged in the pending hash to be flushed to db later, the
+# cached count is changed only if it is cached, a miss is rebuilt from both
+CHANGE_BUFFERED_COUNT_SCRIPT = """
+redis.call('hincrby', KEYS[2], ARGV[1], ARGV[2])
+if redis.call('exists', KEYS[1]) == 0 then
+    return false
+end
+return redis.call('incrby', KEYS[1], ARGV[2])
+"""
+
+# the count of object ARGV[2i + 1] is its db count ARGV[2i + 2] plus its
+# deltas in the pending and flushing hashes KEYS[1] and KEYS[2], added here so
+# no delta logged after db was read is missed. it is cached in KEYS[4 + i]
+# only if no flush is applying (KEYS[3] is the flush id) and none was applied
+# since db was read (the version KEYS[4] is still ARGV[1]). ARGV[2] is the
+# ttl. returns the counts, the ones already cached win
+FILL_BUFFERED_COUNTS_SCRIPT = """
+local can_fill = redis.call('exists', KEYS[3]) == 0
+    and (redis.call('get', KEYS[4]) or '') == ARGV[1]
+local counts = {}
+for i = 1, #KEYS - 4 do
+    local count = redis.call('get', KEYS[4 + i])
+    if not count then
+        local object_id = ARGV[2 * i + 1]
+        count = tonumber(ARGV[2 * i + 2])
+            + tonumber(redis.call('hget', KEYS[1], object_id) or 0)
+            + tonumber(redis.call('hget', KEYS[2], object_id) or 0)
+        if can_fill then
+            redis.call('set', KEYS[4 + i], count, 'ex', ARGV[2])
+        end
+    end
+    counts[i] = tonumber(count)
+end
+return counts
+"""
+
+# a redis set can't be empty, so the cached id set of e.g. a user who follows
+# nobody keeps this placeholder to tell it apart from a cache miss
+EMPTY_SET_PLACEHOLDER = '-1'
+
+# every write to the db data of a cached set bumps the version KEYS[2], and
+# changes the set KEYS[1] only if it is cached, a partial set must not be
+# created. ARGV is the command (sadd or srem), the ttl and the member
+CHANGE_CACHED_SET_SCRIPT = """
+redis.call('incr', KEYS[2])
+redis.call('expire', KEYS[2], ARGV[2])
+if redis.call('exists', KEYS[1]) == 0 then
+    return 0
+end
+return redis.call(ARGV[1], KEYS[1], ARGV[3])
+"""
+
+# fill the set KEYS[1] only if the version KEYS[2] is still ARGV[1], the one
+# read before loading the members from db, otherwise a write happened in the
+# meantime and the loaded members may be outdated. ARGV[2] is the ttl. lua
+# can't unpack more than about 8000 values, the members are added in chunks
+FILL_ID_SET_SCRIPT = """
+local version = redis.call('get', KEYS[2]) or ''
+if version ~= ARGV[1] or redis.call('exists', KEYS[1]) == 1 then
+    return 0
+end
+for i = 3, #ARGV, 1000 do
+    redis.call('sadd', KEYS[1], unpack(ARGV, i, math.min(i + 999, #ARGV)))
+end
+redis.call('expire', KEYS[1], ARGV[2])
+return 1
+"""
+
+# add member ARGV[2i + 1] with score ARGV[2i] to the sorted set KEYS[i] and
+# keep the newest ARGV[1] members, KEYS[n + i] is the fill lock of KEYS[i].
+# sets which are not cached are skipped and will be loaded from db when read,
+# members already in a set are not added. a fill in progress may have read db
+# before the member was written, its lock is dropped so it doesn't cache it
+PUSH_TO_CACHED_TIMELINES_SCRIPT = """
+local limit = tonumber(ARGV[1])
+local n = #KEYS / 2
+local pushed = 0
+for i = 1, n do
+    if redis.call('exists', KEYS[i]) == 1 then
+        pushed = pushed + redis.call('zadd', KEYS[i], ARGV[2 * i], ARGV[2 * i + 1])
+        redis.call('zremrangebyrank', KEYS[i], 0, -limit - 1)
+    else
+        redis.call('del', KEYS[n + i])
+    end
+end
+return pushed
+"""
+
+# rename the timeline KEYS[1] built aside to KEYS[2] if the fill lock KEYS[3]
+# is still held by the token ARGV[1], and release it. otherwise something was
+# pushed meanwhile or the lock expired, the built timeline is dropped
+FILL_TIMELINE_SCRIPT = """
+if redis.call('get', KEYS[3]) ~= ARGV[1] then
+    redis.call('del', KEYS[1])
+    return 0
+end
+redis.call('rename', KEYS[1], KEYS[2])
+redis.call('del', KEYS[3])
+return 1
+"""
+
+# delete the lock only if it is still held by the token
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# check the membership of many values at once, nil if the set is not cached
+ARE_MEMBERS_SCRIPT = """
+if redis.call('exists', KEYS[1]) == 0 then
+    return false
+end
+local result = {}
+for i, value in ipairs(ARGV) do
+    result[i] = redis.call('sismember', KEYS[1], value)
+end
+return result
+"""
 
 
 class RedisHelper:
 
     @classmethod
-    def _load_objects_to_cache(cls, key, objects):
-        conn = RedisClient.get_connection()
+    def get_fill_lock_key(cls, key):
+        return '{}:lock'.format(key)
 
-        serialized_list = []
-        for obj in objects:
-            serialized_data = DjangoModelSerializer.serialize(obj)
-            serialized_list.append(serialized_data)
+    @classmethod
+    def _load_objects_to_cache(cls, key, objects, fields, token=None):
+        """
+        timelines are sorted sets of compact objects scored by created_at.
+        with the token of the fill lock, the timeline is cached only if the
+        lock is still held
+        """
+        mapping = {
+            CompactModelSerializer.serialize(obj, fields): datetime_to_timestamp(obj.created_at)
+            for obj in objects
+        }
+        if not mapping:
+            return
+        # built aside and renamed, readers never see a partial timeline
+        temp_key = '{}:tmp:{}'.format(key, uuid.uuid4().hex)
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline()
+        pipeline.zadd(temp_key, mapping)
+        pipeline.expire(temp_key, settings.REDIS_KEY_EXPIRE_TIME)
+        if token is None:
+            pipeline.rename(temp_key, key)
+        pipeline.execute()
+        if token is not None:
+            fill_timeline = conn.register_script(FILL_TIMELINE_SCRIPT)
+            fill_timeline(keys=[temp_key, key, cls.get_fill_lock_key(key)], args=[token])
 
-        if serialized_list:
-            conn.rpush(key, *serialized_list)
-            conn.expire(key, settings.REDIS_KEY_EXPIRE_TIME)
+    @classmethod
+    def _deserialize_objects(cls, model_class, serialized_list, fields):
+        return [
+            CompactModelSerializer.deserialize(model_class, serialized_data, fields)
+            for serialized_data in serialized_list
+        ]
 
     @classmethod
-    def load_objects(cls, key, queryset):
+    def _load_all_objects(cls, key, queryset, fields):
+        """
+        cache miss, the whole timeline is loaded to cache for the next reads.
+        only the process holding the fill lock queries db, the others wait
+        for the timeline to show up in cache. an object pushed while db is
+        read takes the lock away, and the outdated timeline is not cached
+        """
         queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
         conn = RedisClient.get_connection()
-
-        # if key is in cache, get and return it
-        if conn.exists(key):
-            serialized_list = conn.lrange(key, 0, -1)
-            objects = []
-            for serialized_data in serialized_list:
-                deserialized_obj = DjangoModelSerializer.deserialize(serialized_data)
-                objects.append(deserialized_obj)
+        lock_key = cls.get_fill_lock_key(key)
+        token = uuid.uuid4().hex
+        if conn.set(lock_key, token, nx=True, px=settings.REDIS_FILL_LOCK_TIMEOUT):
+            try:
+                objects = list(queryset)
+                cls._load_objects_to_cache(key, objects, fields, token)
+            finally:
+                release_lock = conn.register_script(RELEASE_LOCK_SCRIPT)
+                release_lock(keys=[lock_key], args=[token])
             return objects
 
-        cls._load_objects_to_cache(key, queryset)
+        while True:
+            time.sleep(0.01)
+            pipeline = conn.pipeline()
+            pipeline.zrevrange(key, 0, -1)
+            pipeline.exists(lock_key)
+            serialized_list, is_locked = pipeline.execute()
+            if serialized_list:
+                return cls._deserialize_objects(queryset.model, serialized_list, fields)
+            # the timeline is empty or the filling process failed
+            if not is_locked:
+                return list(queryset)
+
+    @classmethod
+    def load_timeline(cls, key, queryset, fields, max_timestamp=None, min_timestamp=None, limit=None):
+        """
+        objects created between the timestamps (both excluded), newest first,
+        at most limit of them. a window running past the tail of a full
+        timeline is read from the queryset instead, since older objects are
+        only in db
+        """
+        max_score = '+inf' if max_timestamp is None else '({}'.format(max_timestamp)
+        min_score = '-inf' if min_timestamp is None else '({}'.format(min_timestamp)
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline()
+        pipeline.zcard(key)
+        if limit is None:
+            pipeline.zrevrangebyscore(key, max_score, min_score)
+        else:
+            pipeline.zrevrangebyscore(key, max_score, min_score, start=0, num=limit)
+        size, serialized_list = pipeline.execute()
 
-        # data is stored in list in redis, so keep data type same
-        return list(queryset)
+        if size:
+            objects = cls._deserialize_objects(queryset.model, serialized_list, fields)
+        else:
+            all_objects = cls._load_all_objects(key, queryset, fields)
+            size = len(all_objects)
+            objects = [
+                obj for obj in all_objects
+                if (max_timestamp is None or datetime_to_timestamp(obj.created_at) < max_timestamp)
+                and (min_timestamp is None or datetime_to_timestamp(obj.created_at) > min_timestamp)
+            ][:limit]
+
+        if size < settings.REDIS_LIST_LENGTH_LIMIT:
+            return objects
+        reached_tail = len(objects) < limit if limit is not None else len(objects) == size
+        if not reached_tail:
+            return objects
+
+        if max_timestamp is not None:
+            queryset = queryset.filter(created_at__lt=timestamp_to_datetime(max_timestamp))
+        if min_timestamp is not None:
+            queryset = queryset.filter(created_at__gt=timestamp_to_datetime(min_timestamp))
+        return list(queryset[:limit])
 
     @classmethod
-    def push_object(cls, key, obj, queryset):
-        queryset = queryset[:settings.REDIS_LIST_LENGTH_LIMIT]
+    def push_object(cls, key, obj, queryset, fields):
+        # skipped if the key is not cached, a timeline with only the new
+        # object must not be created. a fill in progress is discarded
+        cls.push_objects([key], [obj], fields)
         conn = RedisClient.get_connection()
         if not conn.exists(key):
             # if key is not in cache, load from db
-            cls._load_objects_to_cache(key, queryset)
-            return
-        serialized_data = DjangoModelSerializer.serialize(obj)
-        conn.lpush(key, serialized_data)
-        conn.ltrim(key, 0, settings.REDIS_LIST_LENGTH_LIMIT - 1)
+            cls._load_all_objects(key, queryset, fields)
+
+    @classmethod
+    def push_objects(cls, keys, objects, fields):
+        """
+        push objects[i] to the cached timeline keys[i] in one round trip,
+        returns how many objects were not in their timeline yet
+        """
+        if not keys:
+            return 0
+        conn = RedisClient.get_connection()
+        push_to_cached_timelines = conn.register_script(PUSH_TO_CACHED_TIMELINES_SCRIPT)
+        args = [settings.REDIS_LIST_LENGTH_LIMIT]
+        for obj in objects:
+            args.append(datetime_to_timestamp(obj.created_at))
+            args.append(CompactModelSerializer.serialize(obj, fields))
+        lock_keys = [cls.get_fill_lock_key(key) for key in keys]
+        return push_to_cached_timelines(keys=list(keys) + lock_keys, args=args)
+
+    @classmethod
+    def get_id_set_version_key(cls, key):
+        return '{}:version'.format(key)
+
+    @classmethod
+    def _load_id_set(cls, key, load_ids):
+        """
+        load the ids from db and cache them, unless the set was written to
+        while they were loaded
+        """
+        conn = RedisClient.get_connection()
+        version_key = cls.get_id_set_version_key(key)
+        version = conn.get(version_key) or b''
+        ids = set(load_ids())
+        fill_id_set = conn.register_script(FILL_ID_SET_SCRIPT)
+        fill_id_set(
+            keys=[key, version_key],
+            args=[version, settings.REDIS_KEY_EXPIRE_TIME, EMPTY_SET_PLACEHOLDER, *ids],
+        )
+        return ids
+
+    @classmethod
+    def load_id_set(cls, key, load_ids):
+        """
+        get a cached set of integer ids, load_ids() is called to fill the
+        cache on a miss
+        """
+        conn = RedisClient.get_connection()
+        members = conn.smembers(key)
+        if members:
+            members.discard(EMPTY_SET_PLACEHOLDER.encode('utf-8'))
+            return set(int(member) for member in members)
+        return cls._load_id_set(key, load_ids)
+
+    @classmethod
+    def get_members_of_id_set(cls, key, ids, load_ids):
+        """
+        return the ids which are in the cached set, one round trip
+        no matter how large the set is
+        """
+        ids = list(ids)
+        if not ids:
+            return set()
+        conn = RedisClient.get_connection()
+        are_members = conn.register_script(ARE_MEMBERS_SCRIPT)
+        result = are_members(keys=[key], args=ids)
+        if result is not None:
+            return set(id for id, is_member in zip(ids, result) if is_member)
+
+        cached_ids = cls._load_id_set(key, load_ids)
+        return set(id for id in ids if id in cached_ids)
+
+    @classmethod
+    def _change_id_set(cls, key, command, id):
+        # called after the db write is committed, so a fill that read the db
+        # before it sees the new version and drops its outdated members
+        conn = RedisClient.get_connection()
+        change_cached_set = conn.register_script(CHANGE_CACHED_SET_SCRIPT)
+        change_cached_set(
+            keys=[key, cls.get_id_set_version_key(key)],
+            args=[command, settings.REDIS_KEY_EXPIRE_TIME, id],
+        )
+
+    @classmethod
+    def add_to_id_set(cls, key, id):
+        # a set that is not cached will be loaded with the id next time
+        cls._change_id_set(key, 'sadd', id)
+
+    @classmethod
+    def remove_from_id_set(cls, key, id):
+        cls._change_id_set(key, 'srem', id)
+
+    @classmethod
+    def invalidate_id_set(cls, key):
+        conn = RedisClient.get_connection()
+        pipeline = conn.pipeline()
+        pipeline.incr(cls.get_id_set_version_key(key))
+        pipeline.expire(cls.get_id_set_version_key(key), settings.REDIS_KEY_EXPIRE_TIME)
+        pipeline.delete(key)
+        pipeline.execute()
 
     @classmethod
     def get_count_key(cls, obj, attr):
-        return '{}.{}:{}'.format(obj.__class__.__name__, attr, obj.id)
+        return '{}.{}:{}'.format(obj.__class__.__name__, attr, obj.pk)
 
     @classmethod
     def incr_count(cls, obj, attr):
@@ -83,7 +387,157 @@ class RedisHelper:
         if count is not None:
             return int(count)
 
+        version = conn.get(cls.get_count_version_key(obj.__class__, attr)) or b''
         obj.refresh_from_db()
-        count = getattr(obj, attr)
-        conn.set(key, count)
-        return count
+        counts = cls._fill_counts(obj.__class__, attr, version, {obj.pk: getattr(obj, attr)})
+        return counts[obj.pk]
+
+    @classmethod
+    def get_counts(cls, objects, attr):
+        """
+        batch version of get_count, one mget and at most one db query.
+        returns a dict of pk -> count
+        """
+        objects = list(objects)
+        if not objects:
+            return {}
+        conn = RedisClient.get_connection()
+        keys = [cls.get_count_key(obj, attr) for obj in objects]
+        counts, missing_ids = {}, []
+        for obj, count in zip(objects, conn.mget(keys)):
+            if count is None:
+                missing_ids.append(obj.pk)
+            else:
+                counts[obj.pk] = int(count)
+        if not missing_ids:
+            return counts
+
+        model_class = objects[0].__class__
+        version = conn.get(cls.get_count_version_key(model_class, attr)) or b''
+        loaded_counts = dict(
+            model_class.objects.filter(pk__in=missing_ids).values_list('pk', attr)
+        )
+        counts.update(cls._fill_counts(model_class, attr, version, loaded_counts))
+        return counts
+
+    @classmethod
+    def _fill_counts(cls, model_class, attr, version, loaded_counts):
+        """
+        cache the counts loaded from db after the flush version was read,
+        unless a flush changed db in the meantime. returns a dict of
+        pk -> count including the deltas not flushed yet
+        """
+        if not loaded_counts:
+            return {}
+        object_ids = list(loaded_counts.keys())
+        keys = list(cls.get_pending_count_keys(model_class, attr))
+        keys.append(cls.get_flush_id_key(model_class, attr))
+        keys.append(cls.get_count_version_key(model_class, attr))
+        args = [version, settings.REDIS_KEY_EXPIRE_TIME]
+        for object_id in object_ids:
+            # the count key only needs the pk
+            keys.append(cls.get_count_key(model_class(pk=object_id), attr))
+            args.append(object_id)
+            args.append(loaded_counts[object_id] or 0)
+        conn = RedisClient.get_connection()
+        fill_counts = conn.register_script(FILL_BUFFERED_COUNTS_SCRIPT)
+        return dict(zip(object_ids, fill_counts(keys=keys, args=args)))
+
+    @classmethod
+    def get_pending_count_keys(cls, model_class, attr):
+        # deltas not written to db yet, and the ones a flush is writing
+        prefix = '{}.{}'.format(model_class.__name__, attr)
+        return '{}:pending'.format(prefix), '{}:flushing'.format(prefix)
+
+    @classmethod
+    def get_flush_id_key(cls, model_class, attr):
+        # set while a flush is applying the flushing hash
+        return '{}.{}:flushing:id'.format(model_class.__name__, attr)
+
+    @classmethod
+    def get_count_version_key(cls, model_class, attr):
+        # bumped before and after a flush changes db, counts loaded from db
+        # across a bump are not cached
+        return '{}.{}:version'.format(model_class.__name__, attr)
+
+    @classmethod
+    def incr_buffered_count(cls, obj, attr):
+        return cls.change_buffered_count(obj, attr, 1)
+
+    @classmethod
+    def decr_buffered_count(cls, obj, attr):
+        return cls.change_buffered_count(obj, attr, -1)
+
+    @classmethod
+    def change_buffered_count(cls, obj, attr, delta):
+        """
+        write behind, the cached count is changed right away and db only by
+        flush_buffered_counts(), so writers don't queue up on a hot row
+        """
+        conn = RedisClient.get_connection()
+        pending_key, _ = cls.get_pending_count_keys(obj.__class__, attr)
+        change_count = conn.register_script(CHANGE_BUFFERED_COUNT_SCRIPT)
+        count = change_count(
+            keys=[cls.get_count_key(obj, attr), pending_key],
+            args=[obj.pk, delta],
+        )
+        if count is not None:
+            return count
+        return cls.get_counts([obj], attr).get(obj.pk)
+
+    @classmethod
+    def flush_buffered_counts(cls, model_class, attr, flush_model):
+        """
+        apply the pending deltas to db, one update for all objects with the
+        same delta. the pending hash is moved aside under a new flush id so
+        new deltas keep piling up, and is dropped only after db has it. the
+        flush id is saved to flush_model in the same transaction as the
+        updates, so a flush that failed anywhere is picked up by the next
+        one and applied exactly once
+        """
+        conn = RedisClient.get_connection()
+        pending_key, flushing_key = cls.get_pending_count_keys(model_class, attr)
+        flush_id_key = cls.get_flush_id_key(model_class, attr)
+        version_key = cls.get_count_version_key(model_class, attr)
+        lock_key = '{}:lock'.format(flushing_key)
+        token = uuid.uuid4().hex
+        if not conn.set(lock_key, token, nx=True, ex=settings.REDIS_FLUSH_LOCK_TIMEOUT):
+            return 0
+        try:
+            if not conn.exists(flushing_key):
+                if not conn.exists(pending_key):
+                    return 0
+                conn.rename(pending_key, flushing_key)
+            # kept if a flush of the same hash failed before
+            conn.set(flush_id_key, uuid.uuid4().hex, nx=True)
+            flush_id = conn.get(flush_id_key).decode('utf-8')
+
+            object_ids_by_delta = defaultdict(list)
+            for object_id, delta in conn.hgetall(flushing_key).items():
+                if int(delta) != 0:
+                    object_ids_by_delta[int(delta)].append(int(object_id))
+            conn.incr(version_key)
+            with transaction.atomic():
+                _, created = flush_model.objects.get_or_create(flush_id=flush_id)
+                if created:
+                    for delta, object_ids in object_ids_by_delta.items():
+                        model_class.objects.filter(pk__in=object_ids)\
+                            .update(**{attr: F(attr) + delta})
+            pipeline = conn.pipeline()
+            pipeline.delete(flushing_key)
+            pipeline.delete(flush_id_key)
+            pipeline.incr(version_key)
+            pipeline.execute()
+            # the flush id is only needed while its hash is left in redis
+            flush_model.objects.filter(flush_id=flush_id).delete()
+            if not created:
+                return 0
+            return sum(len(object_ids) for object_ids in object_ids_by_delta.values())
+        finally:
+            release_lock = conn.register_script(RELEASE_LOCK_SCRIPT)
+            release_lock(keys=[lock_key], args=[token])
+
+    @classmethod
+    def invalidate_count(cls, obj, attr):
+        conn = RedisClient.get_connection()
+        conn.delete(cls.get_count_key(obj, attr))
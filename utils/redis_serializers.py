@@ -1,5 +1,6 @@
 from django.core import serializers
 from utils.json_encoder import JSONEncoder
+from utils.time_helpers import datetime_to_timestamp, timestamp_to_datetime
 
 
 class DjangoModelSerializer:
@@ -14,3 +15,33 @@ class DjangoModelSerializer:
     def deserialize(cls, serialized_data):
         # need to add ".object" to get original object data of the model
         return list(serializers.deserialize('json', serialized_data))[0].object
+
+
+class CompactModelSerializer:
+    """
+    serialize only the given integer fields and created_at of an instance
+    as 'value1:value2:...', created_at is stored in micro seconds.
+    deserialized instances only have these fields set.
+    """
+
+    @classmethod
+    def serialize(cls, instance, fields):
+        values = []
+        for field in fields:
+            value = getattr(instance, field)
+            if field == 'created_at':
+                value = datetime_to_timestamp(value)
+            values.append(str(value))
+        return ':'.join(values)
+
+    @classmethod
+    def deserialize(cls, model_class, serialized_data, fields):
+        if isinstance(serialized_data, bytes):
+            serialized_data = serialized_data.decode('utf-8')
+        data = {}
+        for field, value in zip(fields, serialized_data.split(':')):
+            value = int(value)
+            if field == 'created_at':
+                value = timestamp_to_datetime(value)
+            data[field] = value
+        return model_class(**data)
@@ -1,5 +1,14 @@
+from django.core.cache import caches
 from testing_utils.testcases import TestCase
+from tweets.constants import CACHED_TWEET_FIELDS
+from tweets.models import Tweet, TweetCountFlush
+from twitter.cache import USER_TWEETS_PATTERN
+from utils.local_cache import LocalCache, local_cache
+from utils.memcached_helper import MemcachedHelper, CachedValue, Flight
 from utils.redis_client import RedisClient
+from utils.redis_helper import RedisHelper
+
+import time
 
 
 class UtilsTests(TestCase):
@@ -17,3 +26,181 @@ class UtilsTests(TestCase):
         RedisClient.clear()
         cached_list = conn.lrange('redis_key', 0, -1)
         self.assertEqual(cached_list, [])
+
+    def test_fill_timeline_once(self):
+        user = self.create_user('ray')
+        tweets = [self.create_tweet(user) for _ in range(3)][::-1]
+        queryset = Tweet.objects.filter(user=user).order_by('-created_at')
+        key = USER_TWEETS_PATTERN.format(user_id=user.id)
+        RedisClient.clear()
+        conn = RedisClient.get_connection()
+
+        # another process is filling the timeline, wait instead of querying db
+        conn.set('{}:lock'.format(key), 'token', px=1000)
+        RedisHelper._load_objects_to_cache(key, tweets, CACHED_TWEET_FIELDS)
+        with self.assertNumQueries(0):
+            cached_tweets = RedisHelper.load_timeline(key, queryset, CACHED_TWEET_FIELDS)
+        self.assertEqual([t.id for t in cached_tweets], [t.id for t in tweets])
+
+        # the filling process failed, read from db
+        conn.delete(key)
+        conn.set('{}:lock'.format(key), 'token', px=50)
+        cached_tweets = RedisHelper.load_timeline(key, queryset, CACHED_TWEET_FIELDS)
+        self.assertEqual([t.id for t in cached_tweets], [t.id for t in tweets])
+        self.assertEqual(conn.exists(key), False)
+
+        # the fill lock is released after filling
+        cached_tweets = RedisHelper.load_timeline(key, queryset, CACHED_TWEET_FIELDS)
+        self.assertEqual([t.id for t in cached_tweets], [t.id for t in tweets])
+        self.assertEqual(conn.exists(key), True)
+        self.assertEqual(conn.exists('{}:lock'.format(key)), False)
+
+        # pushing to an expired timeline doesn't create a partial one
+        conn.delete(key)
+        RedisHelper.push_objects([key], [tweets[0]], CACHED_TWEET_FIELDS)
+        self.assertEqual(conn.exists(key), False)
+
+        # a fill which read db before a new tweet was pushed is not cached
+        conn.set('{}:lock'.format(key), 'token', px=1000)
+        new_tweet = self.create_tweet(user)
+        RedisHelper._load_objects_to_cache(key, tweets, CACHED_TWEET_FIELDS, 'token')
+        with self.assertNumQueries(0):
+            cached_tweets = RedisHelper.load_timeline(key, queryset, CACHED_TWEET_FIELDS)
+        self.assertEqual([t.id for t in cached_tweets], [new_tweet.id] + [t.id for t in tweets])
+        self.assertEqual(conn.zcard(key), 4)
+
+    def test_load_large_id_set(self):
+        # more members than lua can unpack at once
+        ids = set(range(1, 10001))
+        self.assertEqual(RedisHelper.load_id_set('id_set', lambda: ids), ids)
+        conn = RedisClient.get_connection()
+        self.assertEqual(conn.scard('id_set'), len(ids) + 1)
+        self.assertEqual(RedisHelper.load_id_set('id_set', lambda: set()), ids)
+
+    def test_get_through_cache(self):
+        cache = caches['testing']
+        load_count = {'value': 0}
+
+        def load_value():
+            load_count['value'] += 1
+            return load_count['value']
+
+        self.assertEqual(MemcachedHelper.get_through_cache('key', load_value), 1)
+        self.assertEqual(MemcachedHelper.get_through_cache('key', load_value), 1)
+        # served from the local cache of the process until it is invalidated
+        cache.set('key', 'raw value')
+        self.assertEqual(MemcachedHelper.get_through_cache('key', load_value), 1)
+        local_cache.invalidate('key')
+
+        # values cached before they were wrapped are still read
+        self.assertEqual(MemcachedHelper.get_through_cache('key', load_value), 'raw value')
+
+        # expired values are refreshed
+        local_cache.delete('key')
+        cache.set('key', CachedValue('expired', 0, time.time() - 1))
+        self.assertEqual(MemcachedHelper.get_through_cache('key', load_value), 2)
+
+        # while another thread refreshes the key, the expired value is served
+        flight = Flight()
+        MemcachedHelper.flights['key'] = flight
+        local_cache.delete('key')
+        cache.set('key', CachedValue('expired', 0, time.time() - 1))
+        self.assertEqual(MemcachedHelper.get_through_cache('key', load_value), 'expired')
+        # or its result is waited for if nothing is cached
+        local_cache.delete('key')
+        cache.delete('key')
+        flight.value, flight.loaded = 'loaded', True
+        flight.event.set()
+        self.assertEqual(MemcachedHelper.get_through_cache('key', load_value), 'loaded')
+        del MemcachedHelper.flights['key']
+        self.assertEqual(load_count['value'], 2)
+
+    def test_local_cache(self):
+        lru = LocalCache(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        self.assertEqual(lru.get('a'), 1)
+        # the least recently used key is evicted
+        lru.set('c', 3)
+        self.assertEqual(lru.get('b'), None)
+        self.assertEqual(lru.get('a'), 1)
+        self.assertEqual(lru.get('c'), 3)
+
+        lru.ttl = 0
+        lru.set('a', 1)
+        self.assertEqual(lru.get('a'), None)
+
+        # invalidating an object drops it from the local cache as well
+        tweet = self.create_tweet(self.create_user('ray'))
+        key = MemcachedHelper.get_key(Tweet, tweet.id)
+        MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        self.assertEqual(local_cache.get(key).id, tweet.id)
+        # every get returns a copy
+        cached_tweet = MemcachedHelper.get_object_through_cache(Tweet, tweet.id)
+        cached_tweet.content = 'changed locally'
+        self.assertEqual(local_cache.get(key).content, 'default tweet content')
+        self.assertEqual(local_cache.get(key) is local_cache.get(key), False)
+        tweet.content = 'changed'
+        tweet.save()
+        self.assertEqual(local_cache.get(key), None)
+        self.assertEqual(MemcachedHelper.get_object_through_cache(Tweet, tweet.id).content, 'changed')
+
+    def test_flush_buffered_counts(self):
+        user = self.create_user('ray')
+        tweets = [self.create_tweet(user) for _ in range(3)]
+        RedisHelper.incr_buffered_count(tweets[0], 'likes_count')
+        RedisHelper.incr_buffered_count(tweets[1], 'likes_count')
+        RedisHelper.incr_buffered_count(tweets[1], 'likes_count')
+        self.assertEqual(RedisHelper.get_count(tweets[1], 'likes_count'), 2)
+        tweets[1].refresh_from_db()
+        self.assertEqual(tweets[1].likes_count, 0)
+
+        # a count missing in cache is rebuilt from db and the pending deltas
+        RedisClient.get_connection().delete(RedisHelper.get_count_key(tweets[1], 'likes_count'))
+        self.assertEqual(RedisHelper.get_counts(tweets, 'likes_count'), {
+            tweets[0].id: 1,
+            tweets[1].id: 2,
+            tweets[2].id: 0,
+        })
+
+        self.assertEqual(RedisHelper.flush_buffered_counts(Tweet, 'likes_count', TweetCountFlush), 2)
+        self.assertEqual(RedisHelper.flush_buffered_counts(Tweet, 'likes_count', TweetCountFlush), 0)
+        for tweet in tweets:
+            tweet.refresh_from_db()
+        self.assertEqual([tweet.likes_count for tweet in tweets], [1, 2, 0])
+
+        # deltas of a flush that failed are applied by the next one
+        conn = RedisClient.get_connection()
+        pending_key, flushing_key = RedisHelper.get_pending_count_keys(Tweet, 'likes_count')
+        RedisHelper.decr_buffered_count(tweets[0], 'likes_count')
+        conn.rename(pending_key, flushing_key)
+        RedisHelper.incr_buffered_count(tweets[2], 'likes_count')
+        self.assertEqual(RedisHelper.flush_buffered_counts(Tweet, 'likes_count', TweetCountFlush), 1)
+        self.assertEqual(RedisHelper.flush_buffered_counts(Tweet, 'likes_count', TweetCountFlush), 1)
+        for tweet in tweets:
+            tweet.refresh_from_db()
+        self.assertEqual([tweet.likes_count for tweet in tweets], [0, 2, 1])
+
+        # a flush committed to db but left in redis is not applied again
+        RedisHelper.incr_buffered_count(tweets[0], 'likes_count')
+        conn.rename(pending_key, flushing_key)
+        conn.set('{}:id'.format(flushing_key), 'committed')
+        TweetCountFlush.objects.create(flush_id='committed')
+        self.assertEqual(RedisHelper.flush_buffered_counts(Tweet, 'likes_count', TweetCountFlush), 0)
+        tweets[0].refresh_from_db()
+        self.assertEqual(tweets[0].likes_count, 0)
+        self.assertEqual(conn.exists(flushing_key), 0)
+        self.assertEqual(TweetCountFlush.objects.count(), 0)
+
+        # a count read from db across a flush is returned but not cached
+        key = RedisHelper.get_count_key(tweets[2], 'likes_count')
+        version_key = RedisHelper.get_count_version_key(Tweet, 'likes_count')
+        conn.delete(key)
+        version = conn.get(version_key)
+        conn.incr(version_key)
+        counts = RedisHelper._fill_counts(Tweet, 'likes_count', version, {tweets[2].id: 1})
+        self.assertEqual(counts, {tweets[2].id: 1})
+        self.assertEqual(conn.exists(key), 0)
+        self.assertEqual(RedisHelper.get_count(tweets[2], 'likes_count'), 1)
+        self.assertEqual(conn.get(key), b'1')
+        self.assertEqual(conn.ttl(key) > 0, True)
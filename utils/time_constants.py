@@ -1,5 +1,6 @@
 # in seconds
 ONE_HOUR = 60 * 60
+ONE_DAY = 24 * ONE_HOUR
 
 # in micro seconds
 MAX_TIMESTAMP = 9999999999999999
\ No newline at end of file
@@ -1,6 +1,17 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import pytz
 
+EPOCH = datetime(1970, 1, 1, tzinfo=pytz.utc)
+
 
 def utc_now():
-    return datetime.now().replace(tzinfo=pytz.utc)
\ No newline at end of file
+    return datetime.now().replace(tzinfo=pytz.utc)
+
+
+def datetime_to_timestamp(dt):
+    # in micro seconds, same as created_at of hbase models
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def timestamp_to_datetime(timestamp):
+    return EPOCH + timedelta(microseconds=timestamp)